@@ -1,11 +1,35 @@
-from flask import Blueprint, request
+from flask import Blueprint, abort, jsonify, request
 
 from .search_engine import search_engine
 
 api = Blueprint("api", __name__, url_prefix="/api/v1")
 
+MAX_FUZZY = 2
+
 
 @api.route("/search")
 def search():
     query = request.args.get("q", "")
-    return search_engine.query(query) if query else ""
+    if not query:
+        return ""
+    if "cursor" in request.args:
+        # opaque token from previous response, can be empty for the first query
+        return search_engine.refine(request.args["cursor"], query)
+    # number of allowed typos per word
+    fuzzy = request.args.get("fuzzy", 0, type=int)
+    return search_engine.query(query, fuzzy=min(max(fuzzy, 0), MAX_FUZZY))
+
+
+@api.route("/metrics")
+def metrics():
+    return search_engine.metrics()
+
+
+@api.route("/reload", methods=["POST"])
+def reload():
+    """Reload geodata, admin only"""
+    if not search_engine.reload_allowed(request.headers.get("Authorization", "")):
+        abort(403)
+    if not search_engine.can_reload:
+        abort(409, search_engine.RELOAD_CONFLICT)
+    return jsonify(search_engine.reload())
@@ -0,0 +1,186 @@
+"""
+ASGI search service with the same /api/v1/search contract as Flask app
+
+    uvicorn asgi:application
+
+Search is CPU-bound, so it runs in one dedicated thread, and the event loop only
+parses requests and sends responses. Queries that arrive while a batch is being
+searched are collected into the next batch, so there's one thread handoff per batch
+instead of per request. Identical queries in flight share one result.
+"""
+
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from key.core.metrics import CONTENT_TYPE
+
+from .api import MAX_FUZZY
+from .search_engine import SearchEngine, search_engine
+
+BATCH_SIZE = 64  # queries searched at once
+
+log = logging.getLogger(__name__)
+SEARCH_PATH = "/api/v1/search"
+METRICS_PATH = "/api/v1/metrics"
+RELOAD_PATH = "/api/v1/reload"
+
+# query, fuzzy, cursor
+QueryKey = Tuple[str, int, Optional[str]]
+
+
+class SearchBatcher:
+    def __init__(self, engine: SearchEngine, batch_size: int = BATCH_SIZE):
+        self.engine = engine
+        self.batch_size = batch_size
+        # one thread, as search holds the GIL anyway, and engine isn't shared between threads
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="search")
+        self._queue: Optional[asyncio.Queue] = None
+        # loop keeps only weak reference to task, so it's kept here
+        self._task: Optional[asyncio.Future] = None
+        self._inflight: Dict[QueryKey, asyncio.Future] = {}
+        self.batches = self.queries = self.deduped = 0
+
+    def start(self):
+        """Start batching in current event loop"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+            self._task.add_done_callback(self._done)
+
+    async def stop(self):
+        """Cancel batching and wait for it, queries in flight aren't answered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = self._queue = None
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def _done(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Search batching stopped", exc_info=task.exception())
+
+    async def search(self, key: QueryKey) -> bytes:
+        """Return encoded results of query, waiting for the batch with it"""
+        self.start()
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.get_event_loop().create_future()
+            self._queue.put_nowait(key)
+        else:
+            self.deduped += 1
+        # other clients may wait for the same future, when this one disconnects
+        return await asyncio.shield(future)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            keys = [await self._queue.get()]
+            while len(keys) < self.batch_size and not self._queue.empty():
+                keys.append(self._queue.get_nowait())
+
+            results = await loop.run_in_executor(self.executor, self._search_batch, keys)
+            self.batches += 1
+            self.queries += len(keys)
+            for key, (body, error) in zip(keys, results):
+                future = self._inflight.pop(key)
+                if error is None:
+                    future.set_result(body)
+                else:
+                    future.set_exception(error)
+
+    def _search_batch(self, keys: List[QueryKey]) -> List[Tuple[bytes, Optional[Exception]]]:
+        """Search and encode results of all queries, runs in executor thread"""
+        results = []
+        for query, fuzzy, cursor in keys:
+            try:
+                results.append((self.engine.encoded(query, fuzzy=fuzzy, cursor=cursor), None))
+            except Exception as e:
+                results.append((b"", e))
+        return results
+
+
+batcher = SearchBatcher(search_engine)
+
+
+def parse_query(query_string: bytes) -> Optional[QueryKey]:
+    """Parse search parameters like Flask api, None for empty query"""
+    args = parse_qs(query_string.decode("latin-1"), keep_blank_values=True)
+    query = args.get("q", [""])[0]
+    if not query:
+        return None
+    cursor = args["cursor"][0] if "cursor" in args else None
+    try:
+        fuzzy = int(args.get("fuzzy", ["0"])[0])
+    except ValueError:
+        fuzzy = 0
+    return query, min(max(fuzzy, 0), MAX_FUZZY), cursor
+
+
+async def respond(send, status: int, body: bytes, content_type: bytes):
+    headers = [
+        (b"content-type", content_type),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*"),
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def reload(scope, send):
+    """Reload geodata in default executor, searches continue meanwhile"""
+    headers = dict(scope["headers"])
+    if not search_engine.reload_allowed(headers.get(b"authorization", b"").decode("latin-1")):
+        await respond(send, 403, b"Forbidden", b"text/plain")
+        return
+    if not search_engine.can_reload:
+        await respond(send, 409, search_engine.RELOAD_CONFLICT.encode(), b"text/plain")
+        return
+    report = await asyncio.get_event_loop().run_in_executor(None, search_engine.reload)
+    await respond(send, 200, json.dumps(report).encode(), b"application/json")
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                batcher.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await batcher.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+    if scope["path"] == METRICS_PATH:
+        await respond(send, 200, search_engine.stats().encode(), CONTENT_TYPE.encode())
+        return
+    if scope["path"] == RELOAD_PATH and scope["method"] == "POST":
+        await reload(scope, send)
+        return
+    if scope["path"] != SEARCH_PATH:
+        await respond(send, 404, b"Not Found", b"text/plain")
+        return
+
+    key = parse_query(scope["query_string"])
+    if key is None:
+        await respond(send, 200, b"", b"text/html; charset=utf-8")
+        return
+    try:
+        body = await batcher.search(key)
+    except Exception:
+        await respond(send, 500, b"Internal Server Error", b"text/plain")
+        raise
+    await respond(send, 200, body, b"application/json")
+
+
+__all__ = ["application", "batcher"]
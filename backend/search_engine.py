@@ -1,18 +1,57 @@
+import hmac
+import logging
 import os
 import pathlib
+import threading
+import time
 
-from flask import jsonify
+from flask import Response
 
-from key.core import engine
+from key.core import engine, geo, metrics, utils
+
+log = logging.getLogger(__name__)
+
+
+def _rss():
+    """Resident memory of process in MiB, None if it's unknown (not linux)"""
+    try:
+        return round(utils.memory_usage()[0] / 2**20, 1)
+    except OSError:
+        return None
 
 
 class SearchEngine:
+    RELOAD_CONFLICT = "Reload is disabled with packed trie (GEOTRIE), its ids belong to old geodata"
+
     def __init__(self, app=None):
         self.app = app
 
-        csv = os.getenv("GEODATA")
-        csv_path = pathlib.Path(__file__).parents[1] / csv
-        self.engine = engine.Engine(file=csv_path)
+        basedir = pathlib.Path(__file__).parents[1]
+        self.path = basedir / os.getenv("GEODATA")  # csv, or snapshot which loads faster
+        packed_trie = os.getenv("GEOTRIE")  # optional, shared between workers via mmap
+        cache_ttl = os.getenv("CACHE_TTL")  # seconds, optional
+        # search stages are timed for /metrics, unless disabled with METRICS=0
+        metrics.enable(os.getenv("METRICS", "1") != "0")
+        self._options = dict(
+            packed_trie=packed_trie and basedir / packed_trie,
+            cache_size=int(os.getenv("CACHE_SIZE", 4096)),
+            cache_ttl=cache_ttl and float(cache_ttl),
+        )
+        first = engine.Engine(file=self.path, **self._options)
+        first.prepare()  # before publishing, reads don't change engine
+        self.engine = first
+        # one writer at a time, readers don't lock
+        self._writer = threading.Lock()
+        self.last_reload = None  # report of the last reload
+
+        # geodata file is checked for changes every RELOAD_INTERVAL seconds, if it's set.
+        # Watcher is started by the first request, so each pre-forked worker has its own
+        interval = os.getenv("RELOAD_INTERVAL")
+        self._watch_interval = interval and float(interval)
+        if self._watch_interval and not self.can_reload:
+            log.warning("RELOAD_INTERVAL is ignored: %s", self.RELOAD_CONFLICT)
+            self._watch_interval = None
+        self._watcher_pid = None
 
         if app is not None:
             self.init_app(app)
@@ -22,9 +61,117 @@ class SearchEngine:
             app.extensions = {}
         app.extensions["search_engine"] = self
 
-    def query(self, string):
-        results = self.engine.search(string)
-        return jsonify(results)
+    def results(self, string, fuzzy=0, cursor=None, as_dict=True, engine=None):
+        """Search results as dict, shared by all backends.
+        With cursor (empty for the first query), continue from previous query of the same client"""
+        if self._watch_interval and self._watcher_pid != os.getpid():
+            self._start_watcher()
+        engine = engine or self.engine
+        if cursor is not None:
+            return engine.refine(cursor or None, string, as_dict=as_dict, ranked=True)
+        # best matches first, count of broad queries isn't shown, so it can be approximate
+        return engine.search(string, as_dict=as_dict, ranked=True, exact_count=False, fuzzy=fuzzy)
+
+    def encoded(self, string, fuzzy=0, cursor=None):
+        """Search results as json, assembled from cached fragments of records"""
+        engine = self.engine  # the same generation for the whole request
+        return engine.encode(self.results(string, fuzzy, cursor, as_dict=False, engine=engine))
+
+    def update(self, records):
+        """Add records into next generation of engine, and publish it when it's ready.
+        Requests in flight finish on the previous one, which is freed after them"""
+        with self._writer:
+            new = self.engine.fork()
+            new.index(records)
+            new.prepare()
+            self.engine = new
+
+    @property
+    def can_reload(self):
+        """Packed trie file is mapped as is, so its ids can't be matched with reloaded records"""
+        return not self._options["packed_trie"]
+
+    def reload(self):
+        """Build engine from geodata file with new record store, and publish it.
+        Requests in flight finish on the previous engine, which is freed after them.
+        Return report with reload time and memory of both engines, while they overlap"""
+        if not self.can_reload:
+            raise RuntimeError(self.RELOAD_CONFLICT)
+        with self._writer:
+            start, clock = time.perf_counter(), metrics.clock()
+            rss_before = _rss()
+            # new records are added to the current registry, previous engine keeps its own
+            previous, geo.GeoRecord.registry = geo.GeoRecord.registry, geo.RecordStore()
+            try:
+                new = engine.Engine(file=self.path, **self._options)
+                new.prepare()
+            except Exception:
+                geo.GeoRecord.registry = previous
+                raise
+            rss_loaded = _rss()
+            old, self.engine = self.engine, new
+            metrics.observe("reload", clock)
+
+        report = self.last_reload = {
+            "path": str(self.path),
+            "records": len(new._index),
+            "previous_records": len(old._index),
+            "seconds": round(time.perf_counter() - start, 3),
+            "rss_before_mib": rss_before,
+            "rss_loaded_mib": rss_loaded,
+            # memory used by new engine, while requests in flight hold the previous one
+            "overlap_mib": rss_before and rss_loaded and round(rss_loaded - rss_before, 1),
+        }
+        log.info("Reloaded geodata: %s", report)
+        return report
+
+    def reload_allowed(self, authorization):
+        """Check authorization header of reload request, it's disabled without RELOAD_TOKEN"""
+        token = os.getenv("RELOAD_TOKEN")
+        return bool(token) and hmac.compare_digest(
+            authorization.encode(), f"Bearer {token}".encode()
+        )
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:  # being replaced
+            return None
+
+    def _start_watcher(self):
+        with self._writer:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name="geodata-watcher", daemon=True).start()
+
+    def _watch(self):
+        """Reload geodata when its file is changed, it should be replaced at once (renamed)"""
+        mtime = self._mtime()
+        while True:
+            time.sleep(self._watch_interval)
+            current = self._mtime()
+            if current is None or current == mtime:
+                continue
+            mtime = current
+            try:
+                self.reload()
+            except Exception:
+                log.exception("Reload of %s failed, previous geodata is used", self.path)
+
+    def stats(self):
+        """Stage timings, result sizes and cache counters in Prometheus text format"""
+        return metrics.render(self.engine.caches)
+
+    def query(self, string, fuzzy=0):
+        return Response(self.encoded(string, fuzzy=fuzzy), mimetype="application/json")
+
+    def refine(self, cursor, string):
+        """Search, continuing from previous query of the same client"""
+        return Response(self.encoded(string, cursor=cursor), mimetype="application/json")
+
+    def metrics(self):
+        return Response(self.stats(), content_type=metrics.CONTENT_TYPE)
 
 
 # init here, but could be in extensions.py
@@ -0,0 +1 @@
+"""Key Search Engine benchmarks, run from repository root: `python -m benchmarks.<name>`"""
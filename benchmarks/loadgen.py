@@ -0,0 +1,123 @@
+"""
+Load generator for search API: concurrent keep-alive clients typing queries char by char
+
+    python -m benchmarks.loadgen geo_tree.csv http://127.0.0.1:8000 -c 64 -d 10
+
+Queries are prefixes of record names, popular names are typed more often, like in
+autosuggest traffic. Reports requests per second and latency percentiles.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+from urllib.parse import urlencode, urlsplit
+
+from core import data
+
+
+def make_queries(path, count: int, seed: int = 0) -> List[str]:
+    """Return keystroke queries: growing prefixes of names, with zipf-like name popularity"""
+    rows = data.read_csv(path)
+    next(rows)  # csv type
+    names = sorted({row.name for row in rows if row.geo_type != "address"})
+    random.seed(seed)
+    random.shuffle(names)
+    weights = [1 / rank for rank in range(1, len(names) + 1)]
+
+    queries: List[str] = []
+    while len(queries) < count:
+        name = random.choices(names, weights)[0]
+        queries.extend(name[:n] for n in range(2, min(len(name), 12) + 1))
+    return queries[:count]
+
+
+class Client:
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, target: str) -> int:
+        """Send GET request over kept-alive connection, return status"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        request = f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n\r\n"
+        self.writer.write(request.encode())
+
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        headers = dict(line.lower().split(": ", 1) for line in header_lines if ": " in line)
+        await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            self.writer.close()
+            self.writer = None
+        return int(status_line.split()[1])
+
+
+async def worker(client: Client, path: str, queries: List[str], deadline: float, stats: dict):
+    i = random.randrange(len(queries))
+    while time.perf_counter() < deadline:
+        target = f"{path}?{urlencode({'q': queries[i % len(queries)]})}"
+        start = time.perf_counter()
+        try:
+            status = await client.get(target)
+        except (OSError, asyncio.IncompleteReadError):
+            client.writer = None
+            stats["errors"] += 1
+            continue
+        stats["latency"].append(time.perf_counter() - start)
+        if status != 200:
+            stats["errors"] += 1
+        i += 1
+
+
+async def run(url: str, queries: List[str], concurrency: int, duration: float) -> dict:
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/") + "/api/v1/search"
+    stats: dict = {"latency": [], "errors": 0}
+    deadline = time.perf_counter() + duration
+    clients = [Client(parts.hostname, parts.port or 80) for _ in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(c, path, queries, deadline, stats) for c in clients))
+    elapsed = time.perf_counter() - start
+
+    latency = sorted(stats["latency"])
+    percentile = lambda p: round(latency[int(p * (len(latency) - 1))] * 1000, 2)  # noqa: E731
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": len(latency),
+        "errors": stats["errors"],
+        "rps": round(len(latency) / elapsed, 1),
+        "latency_ms": (
+            {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99)}
+            if latency
+            else {}
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("infile", help="input .csv file with geodata, to make queries from")
+    parser.add_argument("url", help="base url of running backend")
+    parser.add_argument("-c", "--concurrency", type=int, default=64, help="number of clients")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("-q", "--queries", type=int, default=20000, help="number of queries")
+    parser.add_argument("-o", "--output", help="save results into json file")
+    args = parser.parse_args()
+
+    queries = make_queries(args.infile, args.queries)
+    results = asyncio.get_event_loop().run_until_complete(
+        run(args.url, queries, args.concurrency, args.duration)
+    )
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare memory of dict trie and memory-mapped packed trie, private to each worker process
+
+    python -m benchmarks.packed_memory geo_tree.csv --workers 4
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from core import engine, packed, trie, utils
+
+QUERIES = ("к", "київ", "шевч", "вул", "1")
+
+
+def warmup(index):
+    """Touch all trie nodes/ids, like long-running worker eventually does"""
+    start = time.perf_counter()
+    for query in QUERIES:
+        index.lookup(query)
+    index.collect(False)
+    return time.perf_counter() - start
+
+
+def run_workers(make_index, workers):
+    """Fork workers, which create/touch index, and report their memory"""
+    pids, reads = [], []
+    for _ in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # worker
+            os.close(r)
+            base = utils.memory_usage()
+            index = make_index()
+            warmup(index)
+            os.write(w, json.dumps((base, utils.memory_usage())).encode())
+            os._exit(0)
+        os.close(w)
+        pids.append(pid)
+        reads.append(r)
+
+    results = []
+    for pid, r in zip(pids, reads):
+        with os.fdopen(r) as f:
+            results.append(json.load(f))
+        os.waitpid(pid, 0)
+    return results
+
+
+def report(name, results):
+    print(f"\n{name}:")
+    for i, ((_, _, base_uss), (rss, pss, uss)) in enumerate(results):
+        print(
+            f"  worker {i}: rss {utils.sizeof_fmt(rss)}, pss {utils.sizeof_fmt(pss)}, "
+            f"uss {utils.sizeof_fmt(uss)} (index +{utils.sizeof_fmt(uss - base_uss)})"
+        )
+    print(f"  total pss: {utils.sizeof_fmt(sum(r[1][1] for r in results))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("infile", help="input .csv file with geodata, or binary snapshot")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of workers")
+    args = parser.parse_args()
+
+    engie = engine.Engine(file=args.infile)
+    state = engie._trie.dump()
+    path = os.path.join(tempfile.mkdtemp(), "trie.packed")
+    engie.pack(path)
+    print(f"Packed file: {utils.sizeof_fmt(os.path.getsize(path))}")
+    print(f"Dict trie (total_size): {engie._trie.info['size_trie']}")
+    del engie
+
+    # every worker owns its dict trie, as if it was built/loaded after fork
+    report("dict trie", run_workers(lambda: trie.Trie.restore(_copy(state)), args.workers))
+    report("packed trie", run_workers(lambda: packed.PackedTrie(path), args.workers))
+
+    sample = packed.PackedTrie(path), trie.Trie.restore(state)
+    for query in QUERIES:
+        ids = [index.lookup(query) for index in sample]
+        assert ids[0] == ids[1], f"Different results for {query}"
+    print(f"\nSame results for {QUERIES}, warmup time: packed {warmup(sample[0]):.3f}s, ", end="")
+    print(f"dict {warmup(sample[1]):.3f}s")
+    os.remove(path)
+
+
+def _copy(state):
+    """Deep copy of dict trie nodes, to have private pages in each worker"""
+
+    def copy(node):
+        return {k: copy(v) if k not in trie.KEYS else v[:] for k, v in node.items()}
+
+    root, alphabet, *rest = state  # indexed items, precompute depth, minimized
+    return (copy(root), set(alphabet), *rest)
+
+
+if __name__ == "__main__":
+    main()
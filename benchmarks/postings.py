@@ -0,0 +1,89 @@
+"""
+Compare postings (sorted arrays) with python lists/sets: payload memory and intersection time
+
+    python -m benchmarks.postings geo_tree.csv
+"""
+
+import argparse
+import random
+import time
+from itertools import combinations
+
+from core import engine, trie, utils
+
+
+def payloads(node):
+    """Recursively iterate over id containers of trie nodes"""
+    for key, value in node.items():
+        if key in trie.KEYS:
+            yield value
+        else:
+            yield from payloads(value)
+
+
+def set_process(*ids):
+    """Same as engine.process_sets before postings, sets were built from collected lists"""
+    sets = list(map(set, ids))
+    if len(sets) == 2:
+        return set.intersection(*sets)
+    return set().union(*(set.intersection(*pair) for pair in combinations(sets, 2)))
+
+
+def set_split(a, b):
+    """Same as engine.split_sets before postings, sets were built from collected lists"""
+    a, b = set(a), set(b)
+    c = a.intersection(b)
+    return c, a.difference(c), b.difference(c)
+
+
+def timeit(func, args, repeat=3):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for arg in args:
+            func(*arg)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("infile", help="input .csv file with geodata, or binary snapshot")
+    parser.add_argument("-q", "--queries", type=int, default=500, help="number of queries")
+    args = parser.parse_args()
+
+    engie = engine.Engine(file=args.infile)
+    containers = list(payloads(engie._trie.root))
+    print(f"Payload containers: {len(containers)}, ids: {sum(map(len, containers))}")
+    print(f"  as postings: {utils.total_size(containers)}")
+    print(f"  as lists: {utils.total_size([list(ids) for ids in containers])}")
+
+    # multi-word queries from random record names, 2-4 letter prefixes of each word
+    random.seed(0)
+    records = random.sample(list(engie._index.values()), args.queries)
+    queries = [
+        " ".join(w[: random.randint(2, 4)] for w in trie.preprocess_words(name))
+        for name in (
+            str(r.item.name) + " " + str(r.item.parent.item.name) for r in records if r.item.parent
+        )
+    ]
+    word_ids = [ids for ids in map(engie._trie.lookup, queries) if len(ids) > 1 and all(ids)]
+    word_lists = [list(map(list, ids)) for ids in word_ids]
+    pairs = [pair for ids in word_ids for pair in combinations(ids, 2)]
+    list_pairs = [(list(a), list(b)) for a, b in pairs]
+    print(f"\nQueries: {len(word_ids)}, word pairs: {len(pairs)}")
+
+    for name, func, data in (
+        ("process_sets postings", engine.process_sets, word_ids),
+        ("process_sets sets", set_process, word_lists),
+        ("split_sets postings", engine.split_sets, pairs),
+        ("split_sets sets", set_split, list_pairs),
+        ("process_pair postings", engie.process_pair, pairs[:300]),
+        ("lookup (trie + process_pair)", engie.lookup, [(q,) for q in queries[:100]]),
+    ):
+        print(f"  {name}: {timeit(func, data) * 1000:.1f} ms")
+
+    for ids, lists in zip(word_ids, word_lists):
+        assert set(engine.process_sets(*ids)) == set_process(*lists)
+
+
+if __name__ == "__main__":
+    main()
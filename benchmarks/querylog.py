@@ -0,0 +1,77 @@
+"""
+Query log for benchmarks, generated from record names
+
+    python -m benchmarks.querylog geo_tree.csv -n 2000 -o queries.tsv
+
+Queries are typed prefixes of the most distinctive word of a name, with the word of parent
+name for multi-word queries, typed in latin keyboard layout, or random letters which
+are not found. Log is tab-separated lines of kind and query, the same for the same seed.
+"""
+
+import argparse
+import random
+from typing import List, Tuple
+
+from core import engine, geo, layouts
+
+KINDS = {"prefix": 0.6, "multiword": 0.25, "layout": 0.1, "miss": 0.05}
+LETTERS = "абвгдеєжзиіїйклмнопрстуфхцчшщьюя"
+# cyrillic to latin keys, reverse of ukrainian keyboard layout
+TO_LATIN = str.maketrans({cyr: chr(lat) for lat, cyr in layouts.keymap_uk.items()})
+
+QueryLog = List[Tuple[str, str]]
+
+
+def _prefix(rnd: random.Random, item: geo.GeoItem) -> str:
+    """Prefix of the longest word from random language name"""
+    name = rnd.choice([name.name for name in item]).lower()
+    word = max(name.split(), key=len)
+    return word[: rnd.randint(min(2, len(word)), len(word))]
+
+
+def generate(index: geo.RecordStore, count: int, seed: int = 0) -> QueryLog:
+    """Return queries with their kinds, house numbers aren't typed alone"""
+    rnd = random.Random(seed)
+    ids = sorted(i for i in index if index.type_of(i) != geo.Address.type)
+    kinds, weights = zip(*KINDS.items())
+
+    log = []
+    for _ in range(count):
+        kind = rnd.choices(kinds, weights)[0]
+        item = index[rnd.choice(ids)].item
+        if kind == "multiword" and item.parent:
+            query = f"{_prefix(rnd, item)} {_prefix(rnd, item.parent.item)}"
+        elif kind == "layout":
+            query = _prefix(rnd, item).translate(TO_LATIN)
+        elif kind == "miss":
+            query = "".join(rnd.choices(LETTERS, k=rnd.randint(5, 8)))
+        else:
+            kind, query = "prefix", _prefix(rnd, item)
+        log.append((kind, query))
+    return log
+
+
+def save(log: QueryLog, path) -> None:
+    with open(path, "w") as f:
+        f.writelines(f"{kind}\t{query}\n" for kind, query in log)
+
+
+def load(path) -> QueryLog:
+    with open(path) as f:
+        return [tuple(line.rstrip("\n").split("\t", 1)) for line in f]  # type: ignore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("infile", help="input .csv file with geodata, or binary snapshot")
+    parser.add_argument("-n", "--queries", type=int, default=2000, help="number of queries")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="random seed")
+    parser.add_argument("-o", "--output", required=True, help="save query log into file")
+    args = parser.parse_args()
+
+    engie = engine.Engine(file=args.infile)
+    save(generate(engie._index, args.queries, args.seed), args.output)
+
+
+if __name__ == "__main__":
+    main()
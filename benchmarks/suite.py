@@ -0,0 +1,172 @@
+"""
+Benchmark suite: ingest, trie add, search latency, memory and trie stats, saved as json
+
+    python -m benchmarks.suite geo_tree.csv -o before.json
+    python -m benchmarks.suite geo_tree.csv -o after.json -c before.json
+
+Search runs without result cache over query log from `benchmarks.querylog`, generated
+with fixed seed, or loaded from file. Compare prints changes of all numbers between runs.
+"""
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from core import data, engine, geo, trie, utils
+
+from . import querylog
+
+
+def percentiles(latency: List[float]) -> Dict[str, float]:
+    latency = sorted(latency)
+    return {
+        f"p{p}_ms": round(latency[int(p / 100 * (len(latency) - 1))] * 1000, 3)
+        for p in (50, 90, 99)
+    }
+
+
+def bench_ingest(path) -> Dict:
+    """Build engine from csv, without snapshots"""
+    engie = engine.Engine(cache_size=0)
+    start = time.perf_counter()
+    engie.index(data.read_items(path))
+    elapsed = time.perf_counter() - start
+    return {
+        "engine": engie,
+        "records": len(engie._index),
+        "seconds": round(elapsed, 3),
+        "records_per_s": round(len(engie._index) / elapsed),
+    }
+
+
+def bench_trie_add(index: geo.RecordStore) -> Dict:
+    """Add normalized words of all records into new trie, cost per added suffix"""
+    records = [record for record in index.values() if record.item.type != geo.Address.type]
+    words = [trie.item_words(record.item) for record in records]
+    suffixes = sum(len(word) for record_words in words for word in record_words)
+
+    words_trie = trie.Trie()
+    start = time.perf_counter()
+    for record, record_words in zip(records, words):
+        words_trie.add(record, record_words)
+    elapsed = time.perf_counter() - start
+    return {
+        "records": len(records),
+        "suffixes": suffixes,
+        "seconds": round(elapsed, 3),
+        "ns_per_suffix": round(elapsed / suffixes * 1e9),
+    }
+
+
+def bench_search(engie: engine.Engine, log: querylog.QueryLog) -> Dict:
+    """Ranked search latency, overall and by kind of query"""
+    latency: Dict[str, List[float]] = {kind: [] for kind in querylog.KINDS}
+    found = dict.fromkeys(latency, 0)
+    start = time.perf_counter()
+    for kind, query in log:
+        query_start = time.perf_counter()
+        results = engie.search(query, as_dict=False, ranked=True, exact_count=False)
+        latency[kind].append(time.perf_counter() - query_start)
+        found[kind] += bool(results["count"])
+    elapsed = time.perf_counter() - start
+
+    by_kind = {
+        kind: {"queries": len(values), "found": found[kind], **percentiles(values)}
+        for kind, values in latency.items()
+        if values
+    }
+    return {
+        "queries": len(log),
+        "qps": round(len(log) / elapsed, 1),
+        **percentiles([value for values in latency.values() for value in values]),
+        "by_kind": by_kind,
+    }
+
+
+def bench_memory() -> Dict:
+    """Peak and current memory of process, linux only"""
+    rss, _, _ = utils.memory_usage()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kB on linux
+    return {"peak_rss_mib": round(peak / 2**20, 1), "rss_mib": round(rss / 2**20, 1)}
+
+
+def commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(path, log_path=None, queries=2000, seed=0) -> Dict:
+    ingest = bench_ingest(path)
+    engie = ingest.pop("engine")
+    log = querylog.load(log_path) if log_path else querylog.generate(engie._index, queries, seed)
+    return {
+        "meta": {
+            "commit": commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "infile": str(path),
+            "query_log": str(log_path or f"generated, seed {seed}"),
+        },
+        "ingest": ingest,
+        "trie_add": bench_trie_add(engie._index),
+        "search": bench_search(engie, log),
+        "trie": trie.analyze(engie._trie.root),
+        "memory": bench_memory(),
+    }
+
+
+def _numbers(results: Dict, prefix="") -> Dict[str, float]:
+    """Flatten numbers of nested results into dotted keys"""
+    numbers = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            numbers.update(_numbers(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers[f"{prefix}{key}"] = value
+    return numbers
+
+
+def compare(base: Dict, results: Dict) -> None:
+    """Print changes of numbers between two runs"""
+    print(f"{base['meta']['commit'] or 'base'} -> {results['meta']['commit'] or 'current'}")
+    old, new = _numbers(base), _numbers(results)
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] != new[key]:
+            change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else ""
+            print(f"  {key}: {old[key]} -> {new[key]} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("infile", help="input .csv file with geodata")
+    parser.add_argument("-l", "--log", help="query log file, generated from names by default")
+    parser.add_argument("-n", "--queries", type=int, default=2000, help="queries to generate")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="random seed of query log")
+    parser.add_argument("-o", "--output", help="save results into json file")
+    parser.add_argument("-c", "--compare", metavar="JSON", help="compare with previous results")
+    args = parser.parse_args()
+
+    results = run(args.infile, args.log, args.queries, args.seed)
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
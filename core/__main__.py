@@ -1,7 +1,7 @@
 import sys
 import argparse
 
-from . import engine, utils
+from . import data, engine, metrics, utils
 
 
 class DefaultHelpParser(argparse.ArgumentParser):
@@ -15,7 +15,7 @@ class DefaultHelpParser(argparse.ArgumentParser):
 def main():
 
     parser = DefaultHelpParser(description="Key Search Engine.")
-    parser.add_argument("infile", help="input .csv file with geodata")
+    parser.add_argument("infile", help="input .csv file with geodata, or binary snapshot")
     parser.add_argument(
         "-e",
         "--export",
@@ -26,27 +26,109 @@ def main():
         "-o",
         "--output",
         default="exported.csv",
-        help="output file where exported data is saved (default: exported.csv)",
+        help="output file where exported data is saved, compressed if it ends with .gz or .zst "
+        "(default: exported.csv)",
+    )
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        metavar="PATH",
+        help="save built index into binary snapshot, which can be loaded later as infile",
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        choices=sorted(engine.BACKENDS),
+        default="trie",
+        help="words index implementation (default: trie)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="parse and export csv in this number of processes, 0 for one per cpu (default: 1)",
+    )
+    parser.add_argument(
+        "-p",
+        "--pack",
+        metavar="PATH",
+        help="save trie into packed read-only file, which can be memory-mapped with --mmap",
+    )
+    parser.add_argument(
+        "-m",
+        "--mmap",
+        metavar="PATH",
+        help="use memory-mapped packed trie file instead of building trie",
+    )
+    parser.add_argument(
+        "-d",
+        "--depth",
+        type=int,
+        help="precompute subtree ids for prefixes up to this length, to speed up short queries",
+    )
+    parser.add_argument(
+        "--dawg",
+        action="store_true",
+        help="minimize suffix trie into read-only DAWG, best saved into snapshot",
+    )
+    parser.add_argument(
+        "-c",
+        "--changes",
+        metavar="PATH",
+        help="apply diff .csv with change column (add, update, remove) to the loaded index",
     )
     parser.add_argument(
         "-i", "--interactive", action="store_true", help="run in interactive query mode"
     )
     parser.add_argument("-v", "--verbose", action="store_true", help="output detailed info")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="time stages of indexing and search, print them with cache hit ratios on exit",
+    )
 
     args = parser.parse_args()
+    if args.snapshot and args.mmap:
+        parser.error("packed trie (--mmap) can't be saved into snapshot, build it from csv")
+    if args.pack and (args.backend != "trie" or args.mmap):
+        parser.error("only dict trie (--backend trie) can be packed")
 
     if not args.interactive:
         from . import timing  # noqa
 
-    engie = engine.Engine(file=args.infile)
+    if args.stats:
+        metrics.enable()
+
+    engie = engine.Engine(
+        file=args.infile,
+        backend=args.backend,
+        packed_trie=args.mmap,
+        precompute_depth=args.depth,
+        dawg=args.dawg,
+        jobs=args.jobs,
+    )
+    if args.changes:
+        counts = engie.apply_changes(data.read_changes(args.changes))
+        print(f"Applied changes from {args.changes}: {dict(counts)}")
+
     if args.verbose:
         engie.info()
 
+    if args.snapshot:
+        engie.save_snapshot(args.snapshot)
+
+    if args.pack:
+        engie.pack(args.pack)
+
     if args.export:
-        engie.export(args.output, as_tree=args.export == "tree")
+        engie.export(args.output, as_tree=args.export == "tree", jobs=args.jobs)
 
     if args.interactive:
         engie.interactive()
 
+    if args.stats:
+        print(f"\n{metrics.summary(engie.caches)}\n")
+
 
 main()
@@ -0,0 +1,122 @@
+"""
+Index of address house numbers, kept out of the words trie
+
+Address names are house numbers, the same in all languages, so adding them to the trie
+with all suffixes only multiplies its nodes. Instead, normalized numbers are kept in one
+sorted list with parallel array of address ids, and ids of numbers starting with query
+word are a continuous range, found by binary search. Numbers are matched by prefix only:
+"22" finds "22", "22а" and "220", but not "122". Found addresses are matched with their
+streets like any other ids of query words, through the parent chain.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from typing import Iterable, List, Set, Tuple
+
+from . import postings
+
+# higher than any character of normalized words
+MAX_CHAR = "\U0010ffff"
+# more changes are merged by sorting all numbers again, fewer are inserted one by one
+MERGE_MAX = 1000
+
+
+class AddressIndex:
+    def __init__(self):
+        # sorted numbers, and ids in the same order, replaced together
+        self._sorted: Tuple[List[str], postings.Postings] = ([], array(postings.TYPECODE))
+        # added and removed since the last `prepare`, merged into sorted ones at once
+        self._added: List[Tuple[str, int]] = []
+        self._removed: Set[Tuple[str, int]] = set()
+
+    def __len__(self):
+        return len(self._sorted[0]) + len(self._added)
+
+    @property
+    def info(self):
+        return {"address_numbers": len(self)}
+
+    def add(self, id_: int, words: List[str]) -> None:
+        """Add normalized words of address names, usually one number for all languages"""
+        entries = {(word, id_) for word in words}
+        self._removed -= entries
+        self._added.extend(entries)
+
+    def remove(self, id_: int, words: List[str]) -> None:
+        """Remove address with normalized words of its names"""
+        self._removed.update((word, id_) for word in words)
+
+    @staticmethod
+    def _position(numbers: List[str], ids: postings.Postings, number: str, id_: int) -> int:
+        """Position of entry in sorted numbers and ids, found or to insert"""
+        lo = bisect_left(numbers, number)
+        hi = bisect_right(numbers, number, lo)
+        return bisect_left(ids, id_, lo, hi)
+
+    def _merged(self) -> Tuple[List[str], postings.Postings]:
+        """Sorted numbers and ids with added and removed ones. Few changes are inserted into
+        copies of sorted ones, which can be shared with other generation, many are sorted"""
+        numbers, ids = self._sorted
+        removed, added = self._removed, set(self._added) - self._removed
+        if len(added) + len(removed) > MERGE_MAX:
+            entries = sorted(set(chain(zip(numbers, ids), added)) - removed)
+            return [number for number, _ in entries], array(
+                postings.TYPECODE, (i for _, i in entries)
+            )
+
+        numbers, ids = list(numbers), array(postings.TYPECODE, ids)
+        for number, id_ in removed:
+            i = self._position(numbers, ids, number, id_)
+            if i < len(ids) and ids[i] == id_ and numbers[i] == number:
+                del numbers[i], ids[i]
+        for number, id_ in sorted(added):
+            i = self._position(numbers, ids, number, id_)
+            if i == len(ids) or ids[i] != id_ or numbers[i] != number:
+                numbers.insert(i, number)
+                ids.insert(i, id_)
+        return numbers, ids
+
+    def prepare(self) -> None:
+        """Merge added and removed numbers into sorted ones"""
+        if self._added or self._removed:
+            self._sorted = self._merged()
+            self._added, self._removed = [], set()
+
+    def lookup(self, word: str) -> postings.Postings:
+        """Return ids of addresses with number starting with word, index isn't changed.
+        Numbers added or removed since `prepare` are checked one by one"""
+        numbers, ids = self._sorted
+        lo = bisect_left(numbers, word)
+        hi = bisect_left(numbers, word + MAX_CHAR, lo)
+        found: Iterable[int] = ids[lo:hi]
+        removed = self._removed
+        if removed:
+            found = [i for number, i in zip(numbers[lo:hi], found) if (number, i) not in removed]
+        if self._added:
+            added = (
+                i
+                for number, i in self._added
+                if number.startswith(word) and (number, i) not in removed
+            )
+            found = chain(found, added)
+        return postings.make(found) if found else postings.EMPTY
+
+    def dump(self) -> tuple:
+        """Return index state, built from plain containers only"""
+        self.prepare()
+        return self._sorted
+
+    @classmethod
+    def restore(cls, state: tuple) -> "AddressIndex":
+        """Create index from previously dumped state"""
+        obj = cls()
+        obj._sorted = state
+        return obj
+
+    def fork(self) -> "AddressIndex":
+        """Return new index for adding numbers, this one isn't changed by merges of new one"""
+        return self.restore(self.dump())
+
+
+__all__ = ["AddressIndex"]
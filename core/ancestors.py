@@ -0,0 +1,92 @@
+"""
+Ancestor table for vectorized matching of query words from different geo levels
+
+Table has row for every record, sorted by id, and column for every geo type.
+Cell keeps id of record ancestor with that type (record itself in its own column),
+or NONE. It's built from columns of record store, following parents of all records
+at once. Pair of word postings is matched with numpy in a few passes, instead of
+walking parent chains record by record. After changes of records, only their rows
+and rows of their descendants are walked again. Requires optional numpy package.
+"""
+
+from array import array
+
+from . import geo, postings
+
+try:
+    import numpy as np
+except ImportError:  # optional, Engine falls back to matching with sets
+    np = None
+
+AVAILABLE = np is not None
+NONE = 0  # no ancestor on this level, ids are positive or negative fixups
+
+
+class AncestorTable:
+    def __init__(self, index: geo.RecordStore):
+        rows = len(index.ids)
+        # copies, store arrays can't be resized while numpy views them
+        ids, types = np.array(index.ids, dtype=np.intc), np.array(index.types, dtype=np.uint8)
+        parents = np.array(index.parents, dtype=np.intc)
+
+        # walk parent chains of all rows at once, level by level
+        table = np.full((rows, len(geo.GeoMeta.registry)), NONE, dtype=np.intc)
+        rows_ = current = np.arange(rows)
+        while len(current):
+            column = types[current]
+            empty = table[rows_, column] == NONE  # closest one, like `engine.get_parent`
+            table[rows_[empty], column[empty]] = ids[current[empty]]
+            current = parents[current]
+            alive = current != geo.NO_ROW
+            rows_, current = rows_[alive], current[alive]
+
+        dead = index.dead_rows()
+        if dead:  # removed records, and previous rows of added again ones
+            ids, table = np.delete(ids, dead), np.delete(table, dead, axis=0)
+        order = np.argsort(ids)
+        self.ids = ids[order]
+        self.table = table[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def updated(self, index: geo.RecordStore, changed) -> "AncestorTable":
+        """Return new table with rows of changed records: added, updated or removed ones,
+        and their descendants, which can have other ancestors now. Only rows of them are
+        walked, the rest of table is copied, so this table is still used by readers"""
+        changed = np.unique(np.fromiter(changed, dtype=np.intc))
+        changed = np.union1d(changed, self.ids[np.isin(self.table, changed).any(axis=1)])
+        kept = ~np.isin(self.ids, changed)
+        ids = np.array([i for i in changed.tolist() if i in index], dtype=np.intc)
+        rows = np.full((len(ids), self.table.shape[1]), NONE, dtype=np.intc)
+        for n, id_ in enumerate(ids.tolist()):
+            row = index.row(id_)
+            while row != geo.NO_ROW:
+                if rows[n, index.types[row]] == NONE:  # closest one, like in full build
+                    rows[n, index.types[row]] = index.ids[row]
+                row = index.parents[row]
+
+        obj = AncestorTable.__new__(AncestorTable)
+        kept_ids = self.ids[kept]
+        positions = np.searchsorted(kept_ids, ids)
+        obj.ids = np.insert(kept_ids, positions, ids)
+        obj.table = np.insert(self.table[kept], positions, rows, axis=0)
+        return obj
+
+    def _to_numpy(self, ids: postings.Postings):
+        return np.frombuffer(ids, dtype=np.intc) if ids else np.empty(0, dtype=np.intc)
+
+    def descendants(self, ids, others):
+        """Return ids, which have ancestor (or are themselves) in others"""
+        ancestors = self.table[np.searchsorted(self.ids, ids)]
+        return ids[np.isin(ancestors, others).any(axis=1)]
+
+    def pair(self, ids_a: postings.Postings, ids_b: postings.Postings) -> postings.Postings:
+        """Same as `Engine.process_pair`: ids from a and b, which are the same records,
+        or which are children of records from other postings"""
+        a, b = self._to_numpy(ids_a), self._to_numpy(ids_b)
+        match = np.union1d(self.descendants(a, b), self.descendants(b, a))
+        return array(postings.TYPECODE, match.astype(np.intc).tobytes())
+
+
+__all__ = ["AncestorTable"]
@@ -0,0 +1,79 @@
+"""
+Bounded thread-safe cache for search results
+
+Entries are evicted in least recently used order, when there are more than `maxsize`
+of them, or their total cost (number of cached records) exceeds `maxcost`.
+Optional `ttl` expires entries by age, checked on access.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+class ResultCache:
+    def __init__(self, maxsize: int = 4096, maxcost: int = 100_000, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.maxcost = maxcost
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._cost = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value and mark it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is not MISSING:
+                value, _, created = entry
+                if self.ttl is None or time.monotonic() - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, cost: int = 1) -> None:
+        """Save value, evicting old entries if cache is full"""
+        if not self.maxsize or cost > self.maxcost:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, cost, time.monotonic())
+            self._cost += cost
+            while len(self._entries) > self.maxsize or self._cost > self.maxcost:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, cost, _ = self._entries.pop(key)
+        self._cost -= cost
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._cost = 0
+
+    @property
+    def info(self):
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "cost": self._cost,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / requests, 2) if requests else 0,
+        }
+
+
+__all__ = ["ResultCache"]
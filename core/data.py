@@ -1,9 +1,20 @@
 import csv
+import gzip
+import io
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from functools import partial
-from itertools import chain
-from typing import Iterator, NamedTuple, Optional
+from itertools import chain, groupby, islice
+from operator import attrgetter
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
-from . import geo
+from . import geo, trie
+
+try:
+    import zstandard
+except ImportError:  # optional, only for .zst export
+    zstandard = None
 
 
 class Row(NamedTuple):
@@ -21,6 +32,18 @@ class TreeRow(NamedTuple):
     name_uk: str
 
 
+class DiffRow(NamedTuple):
+    change: str  # one of CHANGES, names are empty for removed records
+    geo_id: int
+    geo_parent_id: Optional[int]
+    geo_type: str
+    name: str
+    name_uk: str
+
+
+ADD, UPDATE, REMOVE = CHANGES = ("add", "update", "remove")
+
+
 # ID helpers
 
 
@@ -36,10 +59,13 @@ def offset_id(offset: int, id_: int) -> int:
 
 # CSV I/O
 
+CSV_FORMAT = dict(escapechar="\\", doublequote=False, quoting=csv.QUOTE_NONNUMERIC)
+
 
 def _row_maker(cls, row):
-    ids = 2 if cls == TreeRow else 1
-    row = chain(map(convert_id, row[:ids]), row[ids:])
+    first = 1 if cls == DiffRow else 0
+    last = first + (1 if cls == Row else 2)
+    row = chain(row[:first], map(convert_id, row[first:last]), row[last:])
     try:
         return cls._make(row)
     except TypeError as e:
@@ -49,7 +75,10 @@ def _row_maker(cls, row):
 def read_csv(path):
     with open(path, newline="") as data:
         header = data.readline()
-        cls = TreeRow if "geo_parent_id" in header else Row
+        if header.lstrip('"').startswith("change"):
+            cls = DiffRow
+        else:
+            cls = TreeRow if "geo_parent_id" in header else Row
         yield cls  # first item is type of csv file we're reading
 
         row_maker = partial(_row_maker, cls)
@@ -58,13 +87,27 @@ def read_csv(path):
             yield row
 
 
-def write_csv(path, data):
-    with open(path, "w", newline="") as csvfile:
-        writer = csv.writer(
-            csvfile, escapechar="\\", doublequote=False, quoting=csv.QUOTE_NONNUMERIC
-        )
-        for row in data:
-            writer.writerow(row)
+# PROCESS POOL
+
+
+def _pool_map(func, chunks: Iterable[list], processes: Optional[int]) -> Iterator:
+    """Map chunks in pool of processes, in order, with a few chunks in flight,
+    so that results are consumed at once and not all of them are kept in memory.
+    There are no more processes than cpus (all of them for None or 0),
+    extra ones would only compete for them"""
+    cpus = os.cpu_count() or 1
+    processes = min(processes or cpus, cpus)
+    if processes == 1:
+        yield from map(func, chunks)  # pool only adds pickling overhead
+        return
+    with ProcessPoolExecutor(processes) as pool:
+        pending: Deque[Future] = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(func, chunk))
+            if len(pending) > 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 # IMPORT
@@ -96,21 +139,103 @@ def read_items(csv: str) -> Iterator[geo.GeoRecord]:
         yield make_record(*row)  # type: ignore
 
 
+def read_changes(csv: str) -> Iterator[Tuple[str, int, Optional[geo.GeoItem]]]:
+    """Read diff csv of tree format with change column into (change, id, item) tuples,
+    item is None for removed records. Parents should be added before their children,
+    and children removed before parents, so rows are read lazily, while they're applied"""
+    rows = read_csv(csv)
+    if next(rows) != DiffRow:
+        raise ValueError(f"{csv} is not a diff, first column should be 'change'")
+    for change, geo_id, geo_parent_id, geo_type, *names in rows:  # type: ignore
+        if change not in CHANGES:
+            raise ValueError(f"Unknown change {change!r} of {geo_id}")
+        item = None
+        if change != REMOVE:
+            cls = geo.GeoMeta.registry[geo_type]
+            parent = geo.GeoRecord.registry[geo_parent_id] if geo_parent_id else None
+            item = cls.from_tree_record(*names, parent=parent)
+        yield change, geo_id, item
+
+
+# PARALLEL IMPORT
+
+CHUNK_SIZE = 2000  # rows parsed by worker at once
+
+# geo_id, geo_parent_id, item, normalized words of item names
+ParsedRow = Tuple[int, Optional[int], geo.GeoItem, List[str]]
+
+
+def _parse_chunk(csv_type: type, rows: List[tuple]) -> List[ParsedRow]:
+    """Parse csv rows into GeoItems without ids and normalize their words for trie.
+    Runs in worker process, so no records are created here"""
+    parsed = []
+    for row in rows:
+        if csv_type == TreeRow:
+            geo_id, geo_parent_id, geo_type, *names = row
+            item = geo.GeoMeta.registry[geo_type].from_tree_record(*names, parent=None)
+        else:
+            geo_id, geo_type, *names = row
+            geo_parent_id = None  # parents are parsed from names, and resolved by engine
+            item = geo.GeoMeta.registry[geo_type].from_row_record(*names)
+        parsed.append((geo_id, geo_parent_id, item, trie.item_words(item)))
+    return parsed
+
+
+def _chunks(rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+    """Split rows into chunks of the same geo type, keeping file order"""
+    for _, level_rows in groupby(rows, key=attrgetter("geo_type")):
+        while True:
+            chunk = [tuple(row) for row in islice(level_rows, CHUNK_SIZE)]
+            if not chunk:
+                break
+            yield chunk
+
+
+def read_items_parallel(
+    csv: str, processes: Optional[int] = None
+) -> Iterator[Tuple[geo.GeoRecord, List[str]]]:
+    """Same as `read_items`, but rows are parsed by process pool, grouped by geo type.
+    Records are created in the same order, each one is yielded with its normalized words"""
+    rows = read_csv(csv)
+    csv_type = next(rows)
+    registry = geo.GeoRecord.registry
+    for parsed in _pool_map(partial(_parse_chunk, csv_type), _chunks(rows), processes):
+        for geo_id, geo_parent_id, item, words in parsed:
+            if geo_parent_id:
+                item.parent = registry[geo_parent_id]
+            yield geo.GeoRecord(geo_id, item), words
+
+
 # EXPORT
 
+EXPORT_CHUNK_SIZE = 10000  # rows formatted and written at once
+
+
+def _full_names(record: geo.GeoRecord, cache: Dict[int, Tuple[str, ...]]) -> Tuple[str, ...]:
+    """Same as `geo.collect_names`, but full names of parents are joined only once"""
+    names = cache.get(record.id)
+    if names is None:
+        item = record.item
+        names = tuple(map(str, item))
+        if item.parent:
+            parent_names = _full_names(item.parent, cache)
+            names = tuple(f"{parent}, {name}" for parent, name in zip(parent_names, names))
+        cache[record.id] = names
+    return names
+
 
 def _collect_rows(index: dict) -> Iterator[list]:
     """Gather data for csv export as denormalized tree"""
     yield ["geo_id", "geo_type", "name", "name_uk"]
     # count up to nearest hundred frrom max id, and append added items from there
     offset = partial(offset_id, (max(index) // 100 + 1) * 100)
+    cache: Dict[int, Tuple[str, ...]] = {}
     # sorted by id
     for key in sorted(index, key=offset):
         record = index[key]
         geo_id = offset(record.id)
-        geo_item = record.item
-        geo_type = geo_item.type
-        yield [geo_id, geo_type, *geo.collect_names(geo_item)]
+        geo_type = record.item.type
+        yield [geo_id, geo_type, *_full_names(record, cache)]
 
 
 def _collect_tree(index: dict) -> Iterator[list]:
@@ -118,20 +243,52 @@ def _collect_tree(index: dict) -> Iterator[list]:
     yield ["geo_id", "geo_parent_id", "geo_type", "name", "name_uk"]
     # count up to nearest hundred frrom max id, and append added items from there
     offset = partial(offset_id, (max(index) // 100 + 1) * 100)
-    order = tuple(geo.GeoMeta.registry)
+    order = {geo_type: i for i, geo_type in enumerate(geo.GeoMeta.registry)}
     # sorted by decreasing area
-    for key in sorted(index, key=lambda x: order.index(index[x].item.type)):
+    for key in sorted(index, key=lambda x: order[index.type_of(x)]):
         record = index[key]
         geo_id = offset(record.id)
         geo_item = record.item
         geo_parent_id = geo_item.parent and offset(geo_item.parent.id)  # can be None
         geo_type = geo_item.type
-        yield [geo_id, geo_parent_id, geo_type, *iter(geo_item)]
+        yield [geo_id, geo_parent_id, geo_type, *map(str, geo_item)]
+
+
+def _format_chunk(rows: List[list]) -> str:
+    """Format rows as csv text, can run in worker process"""
+    buffer = io.StringIO()
+    csv.writer(buffer, **CSV_FORMAT).writerows(rows)
+    return buffer.getvalue()
+
+
+def _chunked(rows: Iterable[list], size: int) -> Iterator[List[list]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _open_output(path):
+    """Open text file for writing, compressed if path ends with .gz or .zst"""
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", newline="")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError(f"Install zstandard package to export into {path}")
+        return zstandard.open(path, "wt", newline="")
+    return open(path, "w", newline="")
 
 
-def write_items(data, path, as_tree):
+def write_items(data, path, as_tree, processes: int = 1):
+    """Write records into csv in chunks, formatting them in `processes` workers.
+    Output is compressed, if path ends with .gz or .zst"""
     collect = _collect_tree if as_tree else _collect_rows
-    write_csv(path, collect(data))
+    chunks = _chunked(collect(data), EXPORT_CHUNK_SIZE)
+    with _open_output(path) as csvfile:
+        csvfile.writelines(_pool_map(_format_chunk, chunks, processes))
 
 
-__all__ = ["read_items", "write_items"]
+__all__ = ["read_items", "read_items_parallel", "read_changes", "write_items"]
@@ -0,0 +1,115 @@
+"""
+Display payloads of records, memoized: full names per language and encoded json fragments
+
+Full names don't depend on query, only their order does: languages where record name
+contains query go first. So each record has at most a few json fragments, one for every
+languages order, and response is assembled from them by concatenation.
+Encoded with optional `orjson` package if it's installed, which is several times faster.
+"""
+
+import json
+from itertools import permutations, zip_longest
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import geo
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib encoder is used
+    orjson = None
+
+# (name, parents full name) for each language
+DisplayNames = Tuple[Tuple[str, Optional[str]], ...]
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact json with sorted keys, like flask.jsonify"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+def display_names(record: geo.GeoRecord) -> DisplayNames:
+    children = map(str, record.item)
+    parents = geo.collect_names(record.item, include_child=False)
+    return tuple(zip_longest(children, parents))
+
+
+def languages_order(names: Tuple[str, ...], query: str) -> Tuple[int, ...]:
+    """Languages with names containing query first, same as `GeoRecord.as_dict`"""
+    return tuple(sorted(range(len(names)), key=lambda i: query in names[i], reverse=True))
+
+
+class Payloads:
+    def __init__(self):
+        # id: display names, and lowercase names to match query
+        self._names: Dict[int, Tuple[DisplayNames, Tuple[str, ...]]] = {}
+        self._fragments: Dict[Tuple[int, Tuple[int, ...]], bytes] = {}
+        # parent id: ids of children, which have payloads themselves or in their descendants
+        self._children: Dict[int, Set[int]] = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def _get(self, record: geo.GeoRecord, query: str) -> Tuple[DisplayNames, Tuple[int, ...]]:
+        try:
+            names, lower = self._names[record.id]
+        except KeyError:
+            names = display_names(record)
+            lower = tuple(name.lower() for name, _ in names)
+            self._names[record.id] = names, lower
+            self._link(record)
+        return names, languages_order(lower, query)
+
+    def as_dict(self, record: geo.GeoRecord, query: str) -> Dict:
+        """Same as `GeoRecord.as_dict`, with memoized names"""
+        names, order = self._get(record, query)
+        return {"id": record.id, "type": record.item.type, "names": [names[i] for i in order]}
+
+    def fragment(self, record: geo.GeoRecord, query: str) -> bytes:
+        """Encoded `as_dict` of record"""
+        names, order = self._get(record, query)
+        key = record.id, order
+        try:
+            return self._fragments[key]
+        except KeyError:
+            fragment = self._fragments[key] = dumps(self.as_dict(record, query))
+            return fragment
+
+    def encode(self, results: Dict) -> bytes:
+        """Encode search results with records, assembling them from fragments"""
+        records: List[geo.GeoRecord] = results["results"]
+        query = results["query"]
+        fragments = b",".join(self.fragment(record, query) for record in records)
+        # "results" is the last of sorted keys, so it's appended to the other ones
+        rest = dumps({key: value for key, value in results.items() if key != "results"})
+        return rest[:-1] + b',"results":[' + fragments + b"]}"
+
+    def _link(self, record: geo.GeoRecord) -> None:
+        """Link record to its parents, up to the one which is already linked,
+        so that payloads of descendants are found from changed parent"""
+        parent = record.item.parent
+        while isinstance(parent, geo.GeoRecord):
+            children = self._children.setdefault(parent.id, set())
+            if record.id in children:
+                return
+            children.add(record.id)
+            record, parent = parent, parent.item.parent
+
+    def discard(self, id_: int) -> None:
+        """Forget payloads of record and its descendants, when it's changed or removed,
+        names of descendants include its name"""
+        entry = self._names.pop(id_, None)
+        if entry is not None:
+            for order in permutations(range(len(entry[0]))):
+                self._fragments.pop((id_, order), None)
+        for child in tuple(self._children.pop(id_, ())):  # readers may add to it
+            self.discard(child)
+
+    def clear(self) -> None:
+        self._names.clear()
+        self._fragments.clear()
+        self._children.clear()
+
+
+__all__ = ["Payloads", "dumps", "display_names"]
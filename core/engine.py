@@ -1,20 +1,43 @@
+import copy
+import heapq
+import secrets
+import time
+from collections import Counter
 from difflib import SequenceMatcher
-from itertools import combinations, groupby
+from itertools import chain, combinations, groupby, islice
 from pprint import pprint
-from typing import Any, Dict, Iterable, List, Set, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from tqdm import tqdm
 
-from . import data, geo, trie, utils
-
-# latin to cyrillic keyboard layout map
-keymap_ru = str.maketrans(
-    r"qwertyuiop[]asdfghjkl;'zxcvbnm,./", r"йцукенгшщзхъфывапролджэячсмитьбю."
-)
-keymap_uk = str.maketrans(
-    r"qwertyuiop[]\asdfghjkl;'zxcvbnm,./", r"йцукенгшщзхїґфівапролджєячсмитьбю."
+from . import (
+    addresses,
+    ancestors,
+    cache,
+    data,
+    display,
+    fuzzy,
+    geo,
+    layouts,
+    metrics,
+    packed,
+    postings,
+    snapshot,
+    suffix_array,
+    trie,
+    utils,
 )
-KEYMAPS = (keymap_uk, keymap_ru)  # ? language preference can be specified somewhere
+
+# implementations of words index with the same add/lookup interface
+BACKENDS = {"trie": trie.Trie, "suffix_array": suffix_array.SuffixArrayIndex}
+
+ChildKey = Tuple[str, Optional[int], str]  # geo type, parent id, full name
+# query words, their trie nodes (None for dead-end) and ids, kept between refinements
+Cursor = Tuple[Tuple[str, ...], Tuple[Any, ...], Tuple[postings.Postings, ...]]
+CURSORS = 10000  # saved states of recent queries
+CURSOR_TTL = 300  # seconds, refinements of one query are typed faster
+# more changed records than this rebuild ancestor table, fewer update their rows
+ANCESTORS_UPDATE_MAX = 10000
 
 
 def same_parents(child1: geo.GeoItem, child2: geo.GeoItem) -> bool:
@@ -45,23 +68,28 @@ def same_parents(child1: geo.GeoItem, child2: geo.GeoItem) -> bool:
     return False
 
 
-def process_sets(*sets: set, exact: bool = False) -> set:
+def child_key(item: geo.GeoItem) -> ChildKey:
+    """Key of item among children of its parent, which should be a record"""
+    return item.type, item.parent and item.parent.id, str(item.name)
+
+
+def process_sets(*sets: postings.Postings, exact: bool = False) -> postings.Postings:
     """Suitable for same-level search words"""
     id_sets = len(sets)
     if id_sets == 2 or exact:
-        return set.intersection(*sets)
+        return postings.intersection(*sets)
 
     if id_sets > 2:
-        # calculate union of paired intersections
-        return set().union(*(set.intersection(*pair) for pair in combinations(sets, 2)))
+        # union of paired intersections, which are ids found in at least two sets
+        return postings.at_least(2, *sets)
 
     return sets[0]
 
 
-def split_sets(a: set, b: set) -> Tuple[set]:
+def split_sets(a: postings.Postings, b: postings.Postings) -> Tuple[postings.Postings, ...]:
     """Return common items and both differences"""
-    c = a.intersection(b)
-    return c, a.difference(c), b.difference(c)
+    c = postings.intersection(a, b)
+    return c, postings.difference(a, c), postings.difference(b, c)
 
 
 def get_parent(record: geo.GeoRecord, level: str) -> geo.GeoRecord:
@@ -71,113 +99,211 @@ def get_parent(record: geo.GeoRecord, level: str) -> geo.GeoRecord:
     return record
 
 
-def match_levels(lo_records: geo.GeoRecord, hi_records: geo.GeoRecord) -> Tuple[Set[int]]:
+def match_levels(
+    index: geo.RecordStore, lo_ids: postings.Postings, hi_ids: postings.Postings
+) -> Tuple[postings.Postings, ...]:
     """When items from different levels are compared, we need to find parents
     from lo level to align with other level. After parent/item comparison return
-    original children records - matched and not matched
+    original children ids - matched and not matched
     """
+    level = index.type_of(hi_ids[0])
 
-    # get one set item :(
-    for hirec in hi_records:
-        break
-    level = hirec.item.type
-
-    nomatch = set()
-    parents = {}  # parent: set(records)
-    for r in lo_records:
-        parent = get_parent(r, level=level)
+    nomatch = []
+    parents: Dict[int, List[int]] = {}  # parent id: [ids]
+    for i in lo_ids:
+        parent = get_parent(index[i], level=level)
         if parent is None:
-            nomatch.add(r)
+            nomatch.append(i)
         else:
-            records = parents.setdefault(parent, set())
-            records.add(r)
+            parents.setdefault(parent.id, []).append(i)
 
-    hit, miss_parents, _miss_records = split_sets(set(parents), hi_records)
+    hit, miss_parents, _miss_ids = split_sets(postings.make(parents), hi_ids)
 
     # children of matched parents
-    match = set().union(*(parents.get(r, set()) for r in hit))
+    match = postings.make(chain.from_iterable(parents[p] for p in hit))
     # children without correct parent + children of not matched parents
-    nomatch = nomatch.union(*(parents.get(r, set()) for r in miss_parents))
+    nomatch = postings.make(chain(nomatch, *(parents[p] for p in miss_parents)))
 
-    # sets of lo level
-    return match, nomatch, _miss_records
+    # ids of lo level
+    return match, nomatch, _miss_ids
 
 
 class Engine:
-    def __init__(self, file=None):
-        self._trie = trie.Trie()
-        # index of added singleton records, handy alias
+    def __init__(
+        self,
+        file=None,
+        backend="trie",
+        packed_trie=None,
+        precompute_depth=None,
+        dawg=False,
+        jobs=1,
+        cache_size=4096,
+        cache_ttl=None,
+        popularity=None,
+    ):
+        self._backend = backend
+        self._trie = BACKENDS[backend]()
+        # house numbers are kept out of the trie
+        self._addresses = addresses.AddressIndex()
+        # store of added records, the current registry, where new records are created
         self._index = geo.GeoRecord.registry
         self._fixup_counter = 0
+        # parents of added items are resolved by exact key, or by similar names
+        self._children: Dict[ChildKey, List[int]] = {}  # key: ids
+        self._parent_counts = {"index": 0, "fuzzy": 0}
+        self._parent_timing = {"index": 0.0, "fuzzy": 0.0}
+        # found records by normalized query, dropped on every add
+        self._cache = cache.ResultCache(maxsize=cache_size, ttl=cache_ttl)
+        # optional static score of records by id, more popular are ranked higher
+        self.popularity: Dict[int, float] = popularity or {}
+        self._ancestors: Optional[ancestors.AncestorTable] = None  # built by `prepare`
+        # table before changes, and ids of changed records, to update it in `prepare`
+        self._outdated: Optional[Tuple[ancestors.AncestorTable, Set[int]]] = None
+        self._type_order = {geo_type: i for i, geo_type in enumerate(geo.GeoMeta.registry)}
+        self._cursors = cache.ResultCache(maxsize=CURSORS, ttl=CURSOR_TTL)
+        # display names and encoded results of records, don't change when records are added
+        self._payloads = display.Payloads()
 
         if file:
-            self.index(data.read_items(file))
-
-    def lookup_same_level(self, query: str) -> Set[int]:
+            if snapshot.is_snapshot(file):
+                self.load_snapshot(file, with_trie=packed_trie is None)
+            elif jobs == 1:
+                self.index(data.read_items(file))
+            else:
+                self.index_parallel(file, jobs or None)
+
+        if packed_trie:
+            # read-only, shared between processes which map the same file
+            self._trie = packed.PackedTrie(packed_trie)
+        elif isinstance(self._trie, trie.Trie):
+            if dawg and not self._trie.minimized:
+                self._trie.minimize()
+            if precompute_depth is not None and precompute_depth != self._trie.precompute_depth:
+                self._trie.precompute(precompute_depth)
+
+    def lookup_same_level(self, query: str) -> postings.Postings:
         exact = True
         word_ids = self._trie.lookup(query, exact=exact)
         return process_sets(*word_ids, exact=exact)
 
     @utils.profile
     def lookup(self, query: str) -> Set[geo.GeoRecord]:
-        word_ids = self._trie.lookup(query, False)
+        return self.match(self.lookup_words(query, False))
+
+    def lookup_words(self, query: str, exact: bool) -> List[postings.Postings]:
+        """Collect ids for each word of query: from trie, and addresses with house numbers
+        starting with the word"""
+        word_ids = self._trie.lookup(query, exact)
+        if not len(self._addresses):
+            return word_ids
+        start = metrics.clock()
+        words = trie.preprocess_words(query)
+        word_ids = [
+            postings.union(ids, self._addresses.lookup(w)) for ids, w in zip(word_ids, words)
+        ]
+        metrics.observe("addresses", start)
+        return word_ids
+
+    def match(self, word_ids: List[postings.Postings]) -> Set[geo.GeoRecord]:
+        """Combine ids of query words into found records"""
+        return {self._index[i] for i in self.match_ids(word_ids)}
+
+    def match_ids(self, word_ids: List[postings.Postings]) -> postings.Postings:
+        """Combine ids of query words into ids of found records"""
         # we have empty resultsets
-        if not all(word_ids):
-            return set()
+        if not word_ids or not all(word_ids):
+            return postings.EMPTY
 
         if len(word_ids) < 2:
-            ids = process_sets(*word_ids)
-            return {self._index[i] for i in ids}
-
+            return process_sets(*word_ids)
+        start = metrics.clock()
         res = (self.process_pair(*pair) for pair in combinations(word_ids, 2))
-        res = process_sets(*res)
-
-        return res
-
-    def process_pair(self, set_a, set_b):
-        """Process pair of id sets. Iterate over first and compare with second.
+        ids = process_sets(*res)
+        metrics.observe("process_pair", start)
+        return ids
+
+    def rank(
+        self, ids: postings.Postings, prefix_ids: List[postings.Postings], k: int
+    ) -> List[geo.GeoRecord]:
+        """Return k best records from ids: matched by prefix of more query words first,
+        then by decreasing area, popularity and id. Worse groups of ids aren't ranked,
+        when there's enough better ones"""
+        start = metrics.clock()
+        index, popularity, order = self._index, self.popularity, self._type_order
+        key = lambda i: (order[index.type_of(i)], -popularity.get(i, 0), i)  # noqa: E731
+
+        # number of query words, matched by prefix: ids
+        prefixes = Counter(chain.from_iterable(postings.intersection(ids, p) for p in prefix_ids))
+        groups: Dict[int, List[int]] = {}
+        for i, n in prefixes.items():
+            groups.setdefault(n, []).append(i)
+
+        best: List[int] = []
+        for n in sorted(groups, reverse=True):
+            best.extend(heapq.nsmallest(k - len(best), groups[n], key=key))
+        if len(best) < k:
+            # matched only in the middle of words
+            rest = postings.difference(ids, postings.make(prefixes))
+            best.extend(heapq.nsmallest(k - len(best), rest, key=key))
+        metrics.observe("rank", start)
+        return [index[i] for i in best]
+
+    def ranked_lookup(
+        self, query: str, k: int, exact_count: bool = True
+    ) -> Tuple[List[geo.GeoRecord], int, bool]:
+        """Return k best found records, their count, and if count is only a lower bound.
+        Without exact count, single word with enough prefix matches skips suffix matches"""
+        prefix_ids = self.lookup_words(query, True)
+        if not exact_count and len(prefix_ids) == 1 and len(prefix_ids[0]) >= k:
+            return self.rank(prefix_ids[0], prefix_ids, k), len(prefix_ids[0]), True
+
+        ids = self.match_ids(self.lookup_words(query, False))
+        return self.rank(ids, prefix_ids, k), len(ids), False
+
+    def process_pair(self, ids_a: postings.Postings, ids_b: postings.Postings) -> postings.Postings:
+        """Process pair of id postings. Iterate over first and compare with second.
         If levels are same - intersect them, otherwise - intersect parents & level.
-        Swap sets & repeat the same.
+        Swap postings & repeat the same. Vectorized with ancestor table, if it's prepared.
         """
+        table = self._ancestors
+        if table is not None:
+            return table.pair(ids_a, ids_b)
+
         order = tuple(geo.GeoMeta.registry)[::-1]  # number/area increasing
-        key = lambda r: order.index(r.item.type)  # noqa: E731
+        key = lambda i: order.index(self._index.type_of(i))  # noqa: E731
 
-        items_a = self.level_records(set_a, key)
-        items_b = self.level_records(set_b, key)
+        items_a = self.level_ids(ids_a, key)
+        items_b = self.level_ids(ids_b, key)
 
-        match = set()
+        match = []
 
         for precise, other in (items_a, items_b), (items_b, items_a):
 
-            for level_a, records_a in precise.items():
-                nomatch_a = set(records_a)  # of current level_a
+            for level_a, level_ids_a in precise.items():
 
-                for level_b, records_b in other.items():
+                for level_b, level_ids_b in other.items():
 
                     if level_a == level_b:
-                        hit, miss_a, _miss_b = split_sets(nomatch_a, records_b)
-                        match |= hit
-                        nomatch_a |= miss_a
+                        hit, _miss_a, _miss_b = split_sets(level_ids_a, level_ids_b)
 
                     elif level_b > level_a:
-                        hit, miss_a, _miss_b = match_levels(nomatch_a, records_b)
-                        match |= hit
-                        nomatch_a |= miss_a
+                        hit, _miss_a, _miss_b = match_levels(self._index, level_ids_a, level_ids_b)
 
                     else:  # we'll get them next time in outer loop
                         continue
 
+                    match.append(hit)
+
             # all b records finished
             # global matched items are updated
             # not matched items are discarded
 
-        return match
+        return postings.union(*match)
 
-    def level_records(self, id_set: Set[int], key) -> Dict[int, List[geo.GeoRecord]]:
-        """Return dictionary of {level: records} from set of ids"""
-        records = (self._index[i] for i in id_set)
-        record_ids = sorted(records, key=key)
-        res = {k: set(g) for k, g in groupby(record_ids, key=key)}
+    def level_ids(self, ids: postings.Postings, key) -> Dict[int, postings.Postings]:
+        """Return dictionary of {level: ids} from ids"""
+        sorted_ids = sorted(ids, key=key)
+        res = {k: postings.make(g) for k, g in groupby(sorted_ids, key=key)}
         return res
 
     @utils.profile
@@ -185,14 +311,63 @@ class Engine:
         """Add collection of geo items to the trie"""
         for item in tqdm(items):  # * progressbar eats memory, but helps a lot
             self.add(item)
+        self._indexed()
 
     @utils.profile
-    def export(self, path, as_tree=False):
-        """Save data from index into csv"""
-        data.write_items(self._index, path, as_tree)
+    def index_parallel(self, path, jobs=None):
+        """Add geo items from csv to the trie, csv rows are parsed by `jobs` processes"""
+        for record, words in tqdm(data.read_items_parallel(path, jobs)):
+            self.add(record, words)
+        self._indexed()
+
+    def _indexed(self):
+        """Finish bulk indexing, or applied changes"""
+        self.prepare()
+
+    @utils.profile
+    def export(self, path, as_tree=False, jobs=1):
+        """Save data from index into csv, rows are formatted by `jobs` processes"""
+        data.write_items(self._index, path, as_tree, jobs)
         print(f"Exported {['denormalized', 'tree'][as_tree]} data to {path}")
 
-    def index_match(self, name: str, ids: Set[int]) -> List[geo.GeoRecord]:
+    @utils.profile
+    def save_snapshot(self, path):
+        """Save built trie and records into binary snapshot"""
+        if not hasattr(self._trie, "dump"):
+            raise TypeError(f"{type(self._trie).__name__} index can't be saved into snapshot")
+        state = {
+            "backend": self._backend,
+            "trie": self._trie.dump(),
+            "records": snapshot.pack_records(self._index),
+            "addresses": self._addresses.dump(),
+            "fixup_counter": self._fixup_counter,
+        }
+        snapshot.save(path, state)
+        print(f"Saved snapshot to {path}")
+
+    @utils.profile
+    def load_snapshot(self, path, with_trie=True):
+        """Load trie and records from binary snapshot, instead of indexing csv"""
+        state = snapshot.load(path)
+        snapshot.unpack_records(state["records"], self._index)
+        if with_trie:
+            self._backend = state["backend"]
+            self._trie = BACKENDS[self._backend].restore(state["trie"])
+        self._addresses = addresses.AddressIndex.restore(state["addresses"])
+        self._fixup_counter = state["fixup_counter"]
+        for record in self._index.values():
+            self._add_child(record)
+        self.prepare()
+
+    @utils.profile
+    def pack(self, path):
+        """Save trie into packed file, which can be memory-mapped as read-only trie"""
+        if not isinstance(self._trie, trie.Trie):
+            raise TypeError(f"Only dict trie can be packed, not {type(self._trie).__name__}")
+        packed.pack(self._trie.root, path, indexed=self._trie.indexed)
+        print(f"Packed trie to {path}")
+
+    def index_match(self, name: str, ids: postings.Postings) -> List[geo.GeoRecord]:
         """Find id by exact name in subset of ids"""
         records = [self._index.get(i) for i in ids]
         matches = [r for r in records if str(r.item.name) == name]
@@ -202,94 +377,383 @@ class Engine:
         """Convert GeoItem to GeoRecord by creating id and save it"""
         self._fixup_counter -= 1
         record = geo.GeoRecord(id=self._fixup_counter, item=item)
+        self._changed(record.id)
+        self._add_child(record)
         return self._trie.add(record)
 
-    def add(self, record: geo.GeoRecord):
-        """Add GeoRecord to trie and index"""
-        self._trie.add(record)
-
+    def _add_child(self, record: geo.GeoRecord):
+        """Add record to children index, its parent should be already resolved.
+        Lists of ids are replaced, not appended, as they're shared by forked engines"""
+        key = child_key(record.item)
+        self._children[key] = [*self._children.get(key, ()), record.id]
+
+    def find_parent(self, item: geo.GeoItem) -> Optional[geo.GeoRecord]:
+        """Find record of item with similar name among items of same level, slow path"""
+        # * lookup by main lang, full name
+        query = str(item.name)
+        ids = self.lookup_same_level(query)
+        if len(ids) == 1:
+            # the one parent that we can't choose
+            record = self._index[ids[0]]
+            return record if same_parents(item, record.item) else None
+
+        # Ambiguous match, detect correct parent.
+        # Most often word "superset" is matched, because
+        # names are split into many words: "aaa-bbb": "aaa", "bbb"
+        # Search by full name in these ids
+        results = self.index_match(query, ids)
+
+        # We may find multiple items with same name, but they may
+        # have different parents. Let's check them
+        checked = [r for r in results if same_parents(item, r.item)]
+        if len(checked) > 1:
+            # same parent, same grandparent, bad
+            raise ValueError(f"Duplicate child-parent paths: {checked}")
+        # no parent found, perhaps the archives are incomplete
+        return checked[0] if checked else None
+
+    def resolve_parent(self, item: geo.GeoItem) -> geo.GeoRecord:
+        """Return record for parent item, adding it if needed.
+        Parent of item itself should be already resolved"""
+        start = time.perf_counter()
+        ids = self._children.get(child_key(item))
+        if ids:
+            if len(ids) > 1:
+                records = [self._index[i] for i in ids]
+                raise ValueError(f"Duplicate child-parent paths: {records}")
+            self._parent_timing["index"] += time.perf_counter() - start
+            self._parent_counts["index"] += 1
+            return self._index[ids[0]]
+
+        # name may differ, like old name instead of new one - fallback to similar names
+        record = self.find_parent(item)
+        if record is None:
+            # Parent is not in index, add the expected parent as is
+            record = self.add_item(item)
+        self._parent_timing["fuzzy"] += time.perf_counter() - start
+        self._parent_counts["fuzzy"] += 1
+        return record
+
+    def _changed(self, id_: int):
+        """Drop results and tables, which depend on indexed records, when record is changed"""
+        if len(self._cache) or len(self._cursors):
+            self._cache.clear()
+            self._cursors.clear()
+        if self._ancestors is not None:
+            self._outdated, self._ancestors = (self._ancestors, set()), None
+        if self._outdated is not None:
+            self._outdated[1].add(id_)
+
+    def _resolve_parents(self, item: geo.GeoItem):
+        """Replace parent items of item with records, adding them if needed"""
         # * item has parents - GeoItems
-        # * check if we have them in index as GeoRecords
-        item = record.item
-        parent = item.parent  # swappable property, item or record
-
-        while parent:
-            if isinstance(parent, geo.GeoRecord):
-                # already swapped, go to next
-                item = parent.item
-                parent = item.parent
-                continue
+        # * check if we have them in index as GeoRecords, starting from the top one,
+        # * so that parents of each are already records
+        children = []
+        while isinstance(item.parent, geo.GeoItem):
+            children.append(item)
+            item = item.parent
+
+        for item in reversed(children):
+            # * swap geoitem parent with georecord
+            item.parent = self.resolve_parent(item.parent)
+
+    def add(self, record: geo.GeoRecord, words: Optional[List[str]] = None):
+        """Add GeoRecord to trie and index, words of record can be already normalized"""
+        self._changed(record.id)
+        if record.item.type == geo.Address.type:
+            words = trie.item_words(record.item) if words is None else words
+            self._addresses.add(record.id, words)
+        else:
+            self._trie.add(record, words)
 
-            # * lookup by main lang, full name
-            query = str(parent.name)
-            ids = self.lookup_same_level(query, exact=True)
-            if ids:
-                if len(ids) == 1:
-                    # the one parent that we can't choose
-                    parent_record = self._index[ids.pop()]
-                    if not same_parents(parent, parent_record.item):
-                        # let's add correct parent
-                        parent_record = self.add_item(parent)
-
-                elif len(ids) > 1:
-                    # Ambiguous match, detect correct parent.
-                    # Most often word "superset" is matched, because
-                    # names are split into many words: "aaa-bbb": "aaa", "bbb"
-                    # Search by full name in these ids
-                    results = self.index_match(query, ids)
-
-                    # We may find multiple items with same name, but they may
-                    # have different parents. Let's check them
-                    checked = [r for r in results if same_parents(parent, r.item)]
-                    if checked:
-                        if len(checked) > 1:
-                            # same parent, same grandparent, bad
-                            raise ValueError(f"Duplicate child-parent paths: {checked}")
-                        parent_record = checked[0]
-                    else:
-                        # no parent found, perhaps the archives are incomplete
-                        # let's add the expected parent as is
-                        parent_record = self.add_item(parent)
-            else:
-                # Parent is not in index, add it
-                parent_record = self.add_item(parent)
+        self._resolve_parents(record.item)
+        self._add_child(record)
 
-            # * swap geoitem parent with georecord, make it next child
-            item.parent = parent = parent_record
+    def _unindex(self, record: geo.GeoRecord):
+        """Remove record from words index and children index, by its current names"""
+        if not hasattr(self._trie, "remove"):
+            raise TypeError(f"{type(self._trie).__name__} index is read-only")
+        if record.item.type == geo.Address.type:
+            self._addresses.remove(record.id, trie.item_words(record.item))
+        else:
+            self._trie.remove(record)
+
+        key = child_key(record.item)
+        ids = [i for i in self._children.get(key, ()) if i != record.id]
+        if ids:
+            self._children[key] = ids
+        else:
+            self._children.pop(key, None)
+
+    def remove(self, id_: int) -> geo.GeoRecord:
+        """Remove record by id from index, cost depends only on its words.
+        Its children should be removed first, otherwise they would be left without parent"""
+        if id_ not in self._index:
+            raise KeyError(id_)
+        if self._index.has_children(id_):
+            raise ValueError(f"Record {id_} has children, they should be removed first")
+        record = self._index[id_]
+        self._changed(id_)
+        self._unindex(record)
+        self._index.remove(id_)
+        self._payloads.discard(id_)
+        return record
+
+    def update(self, id_: int, item: geo.GeoItem) -> geo.GeoRecord:
+        """Replace names, type or parent of record, like renamed city with old name.
+        Record keeps its id and children, its old words are removed from index"""
+        if id_ not in self._index:
+            raise KeyError(id_)
+        record = self._index[id_]
+        self._changed(id_)
+        self._unindex(record)
+        self._resolve_parents(item)
+        self._index.replace(id_, item)
+        if record.item.type == geo.Address.type:
+            self._addresses.add(id_, trie.item_words(record.item))
+        else:
+            self._trie.add(record)
+        self._add_child(record)
+        self._payloads.discard(id_)  # with descendants, their full names are changed too
+        return record
+
+    def apply_changes(self, changes: Iterable[Tuple[str, int, Optional[geo.GeoItem]]]) -> Counter:
+        """Add, update and remove records, listed in diff csv, see `data.read_changes`.
+        Return counts of applied changes"""
+        counts: Counter = Counter()
+        for change, id_, item in changes:
+            if change == data.ADD:
+                self.add(geo.GeoRecord(id_, item))
+            elif change == data.UPDATE:
+                self.update(id_, item)
+            else:
+                self.remove(id_)
+            counts[change] += 1
+        self._indexed()
+        return counts
 
     # HELPERS
 
     def info(self):
+        cached = ((f"cache_{key}", value) for key, value in self._cache.info.items())
+        parents = {
+            f"parents_{path}": f"{count} in {self._parent_timing[path]:.2f}s"
+            for path, count in self._parent_counts.items()
+        }
         info = "\n".join(
-            f"{key.title()}: {value}" for key, value in sorted(self._trie.info.items())
+            f"{key.title()}: {value}"
+            for key, value in sorted(
+                chain(
+                    self._trie.info.items(),
+                    self._addresses.info.items(),
+                    self._index.info.items(),
+                    parents.items(),
+                    cached,
+                )
+            )
         )
         print(f"\n{info}\n")
 
-    def wrong_layout(self, query: str) -> Tuple[str, Set[geo.GeoRecord]]:
-        """Search same query in other keyboard layouts.
-        Return translated query and results"""
-        for m in KEYMAPS:
-            translated = query.translate(m)
-            recs = self.lookup(translated)
-            if recs:
-                return (translated, recs)
-        return (query, set())
-
-    def search(self, query, as_dict=True, maxcount=20) -> Dict:
-        """Perform search and return records"""
-        records = self.lookup(query)
-        if not records:
-            query, records = self.wrong_layout(query)
-
-        # Filter & format search results
-        items: List[Any] = []
-        hidden = count = len(records)
-        for record in records:
-            if len(items) < maxcount:
-                item = record.as_dict(query) if as_dict else record
-                items.append(item)
-                hidden -= 1
-        return {"results": items, "query": query, "hidden": hidden, "count": count}
+    @property
+    def caches(self) -> Dict[str, cache.ResultCache]:
+        """Caches of engine by name, for metrics"""
+        return {"results": self._cache, "cursors": self._cursors}
+
+    def prepare(self):
+        """Merge added records into lookup tables, after indexing and before publishing
+        engine, so that concurrent reads don't change it. Searches don't prepare anything,
+        records added after it are found by slower paths until the next one.
+        Called before forking workers too, so that they share tables with parent process"""
+        self._addresses.prepare()
+        if isinstance(self._trie, suffix_array.SuffixArrayIndex):
+            self._trie.prepare()
+        if ancestors.AVAILABLE and self._ancestors is None:
+            if self._outdated is not None and len(self._outdated[1]) < ANCESTORS_UPDATE_MAX:
+                self._ancestors = self._outdated[0].updated(self._index, self._outdated[1])
+            else:
+                self._ancestors = ancestors.AncestorTable(self._index)
+            self._outdated = None
+
+    def fork(self) -> "Engine":
+        """Return next generation of engine to add records into, sharing unchanged parts of
+        index with this one. This engine isn't changed and keeps serving reads meanwhile,
+        without locks, until new one is published by replacing reference to it.
+        Records are added to the shared record store, so only the newest generation is updated.
+        Updated records are rewritten in place, and removed ones are kept in store for readers
+        of previous generation, which see new names of updated records before publishing"""
+        if not hasattr(self._trie, "fork"):
+            raise TypeError(f"{type(self._trie).__name__} index is read-only")
+        engine = copy.copy(self)
+        engine._trie = self._trie.fork()
+        engine._addresses = self._addresses.fork()
+        engine._children = dict(self._children)
+        engine._parent_counts = dict(self._parent_counts)
+        engine._parent_timing = dict(self._parent_timing)
+        # found results and cursors are different in new generation
+        engine._cache = cache.ResultCache(self._cache.maxsize, self._cache.maxcost, self._cache.ttl)
+        engine._cursors = cache.ResultCache(maxsize=CURSORS, ttl=CURSOR_TTL)
+        # table is replaced on changes, ids of changes since it was built are copied
+        engine._outdated = self._outdated and (self._outdated[0], set(self._outdated[1]))
+        return engine
+
+    def fuzzy_lookup(self, query: str, k: int, limit: int) -> Tuple[List[geo.GeoRecord], int, bool]:
+        """Return k found records with up to `limit` typos in each word, closest ones first,
+        their count, and if search was cut by budget, so results are incomplete"""
+        start = metrics.clock()
+        words_ids, exceeded = fuzzy.lookup(self._trie, query, limit)
+        for groups, word in zip(words_ids, trie.preprocess_words(query)):
+            groups[0] = postings.union(groups[0], self._addresses.lookup(word))  # no typos
+        best: List[geo.GeoRecord] = []
+        ids = postings.EMPTY
+        for distance in range(limit + 1):
+            # records found with words up to this distance, which weren't found before
+            prev = ids
+            ids = self.match_ids([postings.union(*groups[: distance + 1]) for groups in words_ids])
+            best.extend(self.rank(postings.difference(ids, prev), [], k - len(best)))
+        metrics.observe("fuzzy", start)
+        return best, len(ids), exceeded
+
+    def cached_lookup(
+        self,
+        query: str,
+        maxcount: int,
+        ranked: bool = False,
+        exact_count: bool = True,
+        fuzzy: int = 0,
+    ) -> Tuple[List[geo.GeoRecord], int, bool]:
+        """Return up to maxcount found records, total count and if it's approximate.
+        Results are cached by normalized query"""
+        key = (tuple(trie.preprocess_words(query)), maxcount, ranked, exact_count, fuzzy)
+        found = self._cache.get(key)
+        if found is None:
+            if fuzzy and hasattr(self._trie, "children"):
+                found = self.fuzzy_lookup(query, maxcount, fuzzy)
+            elif ranked:
+                found = self.ranked_lookup(query, maxcount, exact_count)
+            else:
+                records = self.lookup(query)
+                found = list(islice(records, maxcount)), len(records), False
+            self._cache.put(key, found, cost=len(found[0]) + 1)
+        return found
+
+    def search(
+        self, query, as_dict=True, maxcount=20, ranked=False, exact_count=True, fuzzy=0
+    ) -> Dict:
+        """Perform search and return records, best ones first if ranked.
+        Ranked search without exact count may return only lower bound of count.
+        Fuzzy search allows up to `fuzzy` typos (edits) per word, ranked by their number"""
+        start = metrics.clock()
+        options = ranked, exact_count, fuzzy
+        records, count, approximate = self.cached_lookup(query, maxcount, *options)
+        layout = None
+        if not count:
+            # retry in other keyboard layouts and transliterated, cached like the query itself,
+            # layouts without results are skipped by trie walk
+            retry = metrics.clock()
+            for layout, translated in layouts.candidates(self._trie, query):
+                found = self.cached_lookup(translated, maxcount, *options)
+                records, count, approximate = found
+                if count:
+                    query = translated
+                    break
+            else:
+                layout = None
+            metrics.observe("wrong_layout", retry)
+
+        results = self._results(query, records, count, as_dict, approximate)
+        if layout:
+            results["layout"] = layout  # query was translated from other layout
+        metrics.size("search", count)
+        metrics.observe("search", start)
+        return results
+
+    def _results(
+        self, query, records: List[geo.GeoRecord], count: int, as_dict: bool, approximate=False
+    ) -> Dict:
+        """Format search results, names order depends on raw query, so they're not cached"""
+        start = metrics.clock() if as_dict else 0.0
+        items: List[Any] = [
+            self._payloads.as_dict(record, query) if as_dict else record for record in records
+        ]
+        metrics.observe("as_dict", start)
+        results = {"results": items, "query": query, "hidden": count - len(items), "count": count}
+        if approximate:
+            results["approximate"] = True  # count is lower bound
+        return results
+
+    def encode(self, results: Dict) -> bytes:
+        """Encode results of search with `as_dict=False` into json"""
+        start = metrics.clock()
+        encoded = self._payloads.encode(results)
+        metrics.observe("encode", start)
+        return encoded
+
+    def _walk_words(self, words: List[str], prev: Optional[Cursor]) -> Cursor:
+        """Find trie nodes and ids of words. When word extends the previous word
+        at the same position, move down from its node, instead of the root"""
+        prev_words, prev_nodes, prev_ids = prev or ((), (), ())
+        nodes, word_ids = [], []
+        for i, word in enumerate(words):
+            prev_word = prev_words[i] if i < len(prev_words) else None
+            if word == prev_word:
+                nodes.append(prev_nodes[i])
+                word_ids.append(prev_ids[i])
+                continue
+
+            start = metrics.clock()
+            if prev_word is not None and word.startswith(prev_word):
+                # dead-end stays dead-end
+                node = prev_nodes[i]
+                node = node if node is None else self._trie.walk(word[len(prev_word) :], node)
+            else:
+                node = self._trie.walk(word)
+            metrics.observe("trie_descent", start)
+            nodes.append(node)
+            start = metrics.clock()
+            ids = postings.EMPTY if node is None else self._trie.node_ids(node)
+            metrics.observe("collect", start)
+            word_ids.append(postings.union(ids, self._addresses.lookup(word)))
+        return tuple(words), tuple(nodes), tuple(word_ids)
+
+    def refine(
+        self, cursor: Optional[str], query: str, as_dict=True, maxcount=20, ranked=False
+    ) -> Dict:
+        """Same as search, but continues from the previous query, saved under cursor.
+        Returns cursor of this query in results, to refine it further"""
+        if not hasattr(self._trie, "walk"):
+            # index without trie nodes
+            return {**self.search(query, as_dict, maxcount, ranked), "cursor": None}
+
+        start = metrics.clock()
+        prev = self._cursors.get(cursor) if cursor else None
+        words, nodes, word_ids = state = self._walk_words(trie.preprocess_words(query), prev)
+        if ranked:
+            ids = self.match_ids(list(word_ids))
+            prefix_ids = [
+                postings.union(
+                    postings.EMPTY if n is None else self._trie.node_ids(n, exact=True),
+                    self._addresses.lookup(w),
+                )
+                for w, n in zip(words, nodes)
+            ]
+            found = self.rank(ids, prefix_ids, maxcount)
+            count = len(ids)
+        else:
+            records = self.match(list(word_ids))
+            found, count = list(islice(records, maxcount)), len(records)
+
+        if count:
+            results = self._results(query, found, count, as_dict)
+        else:
+            # try other keyboard layouts
+            results = self.search(query, as_dict, maxcount, ranked)
+
+        results["cursor"] = secrets.token_urlsafe(8)
+        self._cursors.put(results["cursor"], state)
+        metrics.size("refine", count)
+        metrics.observe("refine", start)
+        return results
 
     def interactive(self):
         query = "Enter query (empty to exit):"
@@ -303,7 +767,7 @@ class Engine:
             if not query:
                 continue
 
-            data = self.search(query, as_dict=False)
+            data = self.search(query, as_dict=False, ranked=True)
             dquery = data.get("query", query)
             if query != dquery:
                 print(f"Did you mean _{dquery}_?")
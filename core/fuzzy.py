@@ -0,0 +1,71 @@
+"""
+Typo-tolerant lookup with Levenshtein automaton over the trie
+
+Trie is walked depth-first, keeping the row of edit distances between query word
+and the current node path (prefix of some indexed word suffix). Branches where
+every distance in the row exceeds the limit can't match anymore and are pruned.
+Nodes with path close enough to the word are collected, like a regular prefix lookup.
+
+Works with any index which provides `walk`, `children` and `node_ids`.
+"""
+
+from typing import Any, List, Tuple
+
+from . import postings
+from .trie import preprocess_words
+
+# visited trie nodes per query, results are incomplete after that
+BUDGET = 20000
+
+
+def max_distance(word: str, limit: int) -> int:
+    """Allow less typos in short words, so they don't match everything"""
+    return max(0, min(limit, (len(word) - 1) // 2))
+
+
+def find_nodes(index, word: str, limit: int, budget: int) -> Tuple[List[Tuple[Any, int]], int]:
+    """Find nodes with paths within `limit` edits from word, and their distances.
+    Nodes below already found ones are returned only if they are closer.
+    Return nodes and the rest of budget"""
+    found = []
+    # node, distances row, distance of closest found node on path
+    stack = [(index.walk(""), list(range(len(word) + 1)), limit + 1)]
+    while stack and budget > 0:
+        node, row, best = stack.pop()
+        for c, child in index.children(node):
+            budget -= 1
+            new_row = [row[0] + 1]
+            for i, wc in enumerate(word, 1):
+                new_row.append(min(new_row[i - 1] + 1, row[i] + 1, row[i - 1] + (wc != c)))
+
+            distance, child_best = new_row[-1], best
+            if distance < best:
+                found.append((child, distance))
+                child_best = distance
+            if child_best and min(new_row) <= limit:
+                stack.append((child, new_row, child_best))
+    return found, budget
+
+
+def lookup(
+    index, query: str, limit: int, budget: int = BUDGET
+) -> Tuple[List[List[postings.Postings]], bool]:
+    """Collect items ids for each word of query, grouped by edit distance: [d0, d1, ...],
+    each id is in group of its smallest distance. Return them, and if budget was exceeded"""
+    words_ids = []
+    for word in preprocess_words(query):
+        nodes, budget = find_nodes(index, word, max_distance(word, limit), budget)
+        by_distance: List[List[postings.Postings]] = [[] for _ in range(limit + 1)]
+        for node, distance in nodes:
+            by_distance[distance].append(index.node_ids(node))
+
+        groups, seen = [], postings.EMPTY
+        for ids in by_distance:
+            ids = postings.difference(postings.union(*ids), seen)
+            seen = postings.union(seen, ids)
+            groups.append(ids)
+        words_ids.append(groups)
+    return words_ids, budget <= 0
+
+
+__all__ = ["lookup"]
@@ -1,12 +1,28 @@
 import re
-from dataclasses import dataclass
+from array import array
+from collections.abc import Mapping
 from itertools import zip_longest
-from typing import ClassVar, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from typing import (
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 RAIONKEY = "район"  # bilingual unique key for raion/district
 WORD_SEP = re.compile(r", (?![^(]*\))")
 OLD_NAME = re.compile(r"\s*\(\s*(?P<old_name>.*?)\s*\)\s*")
 SPACES = re.compile(" {2,}")
+LANGS = 2  # names of item, in russian and ukrainian
+FIELDS = 2 * LANGS  # name and old name for each language
+NO_ROW = -1  # missing parent or record
+DENSE_SLACK = 1024  # ids up to twice the number of records are kept in array
 
 
 class Name(NamedTuple):
@@ -70,19 +86,50 @@ class GeoMeta(type):
         geo = super().__new__(cls, name, bases, dct)
         if bases:  # then it's GeoItem
             geo.type = name.lower()
+            geo.code = len(cls.registry)  # type code in record store
             cls.registry[geo.type] = geo  # add geotype registry to meta
         return geo
 
 
 class GeoItem(metaclass=GeoMeta):
-    """Simple class that contains name and type, without id"""
+    """Simple class that contains name and type, without id.
+    Item of added record is a view of its row in record store"""
 
-    __slots__ = ["name", "name_uk", "parent"]
+    __slots__ = ["_names", "_parent", "_row", "_store"]
     type = None
+    code = None
 
     def __init__(self, names: LangNames, parent: AnyGeo = None):
-        self.name, self.name_uk, *_ = names
-        self.parent: AnyGeo = parent
+        name, name_uk, *_ = names
+        self._names = (name, name_uk)
+        self._parent: AnyGeo = parent
+        self._row: Optional[int] = None
+        self._store: Optional[RecordStore] = None
+
+    @classmethod
+    def _view(cls, row: int, store: "RecordStore") -> "GeoItem":
+        item = cls.__new__(cls)
+        item._row, item._store = row, store
+        return item
+
+    @property
+    def name(self) -> Name:
+        return self._names[0] if self._row is None else self._store.name(self._row, 0)
+
+    @property
+    def name_uk(self) -> Name:
+        return self._names[1] if self._row is None else self._store.name(self._row, 1)
+
+    @property
+    def parent(self) -> AnyGeo:
+        return self._parent if self._row is None else self._store.parent(self._row)
+
+    @parent.setter
+    def parent(self, parent: AnyGeo):
+        if self._row is None:
+            self._parent = parent
+        else:
+            self._store.set_parent(self._row, parent)
 
     def __iter__(self):
         """Iterate over languages/Names"""
@@ -123,34 +170,47 @@ class GeoItem(metaclass=GeoMeta):
         return self
 
 
-@dataclass(frozen=True)
 class GeoRecord:
-    """Container for GeoItem with id"""
-
-    __slots__ = ["id", "item"]
-    id: int
-    item: GeoItem
-    registry: ClassVar[Dict[int, "GeoRecord"]] = {}
-
-    def __new__(cls, id, item):
-        try:
-            obj = cls.registry[id]
-        except KeyError:
-            obj = object.__new__(cls)
-            cls.registry[id] = obj
-        else:
-            if (obj.id == id) != (obj.item == item):
-                raise ValueError(f"Collision with existing {obj}: ({id}, {item})")
+    """Container for GeoItem with id, a view of its row in record store.
+    New records are added into `registry` store, views keep the store they were made from,
+    so records of previous store are still readable after it's replaced with new one"""
+
+    __slots__ = ["id", "_row", "_store"]
+    registry: ClassVar["RecordStore"]
+
+    def __new__(cls, id: int, item: Optional[GeoItem] = None):
+        """Add item with id into store, or return existing record"""
+        store = cls.registry
+        row = store.find(id)
+        if row is None:
+            if item is None:
+                raise KeyError(id)
+            row = store.append(id, item)
+        elif item is not None and store.item(row) != item:
+            raise ValueError(f"Collision with existing {store[id]}: ({id}, {item})")
+        return cls._view(id, row, store)
+
+    @classmethod
+    def _view(cls, id: int, row: int, store: "RecordStore") -> "GeoRecord":
+        obj = object.__new__(cls)
+        obj.id, obj._row, obj._store = id, row, store
         return obj
 
+    @property
+    def item(self) -> GeoItem:
+        return self._store.item(self._row)
+
     def __hash__(self):
         return hash(self.id)
 
     def __eq__(self, other):
         if isinstance(other, GeoRecord):
-            return (self.id, self.item) == (other.id, other.item)
+            return self.id == other.id  # same row of the same store, or the same record
         return NotImplemented
 
+    def __repr__(self):
+        return f"GeoRecord(id={self.id}, item={self.item!r})"
+
     def as_dict(self, query: str) -> Dict:
         children = map(str, self.item)
         parents = collect_names(self.item, include_child=False)
@@ -163,6 +223,238 @@ class GeoRecord:
         return {"id": self.id, "type": self.item.type, "names": names}
 
 
+class Strings:
+    """Table of interned strings, referenced by offsets. Offset 0 is None"""
+
+    def __init__(self, strings: Optional[List[Optional[str]]] = None):
+        self.strings: List[Optional[str]] = strings or [None]
+        self._offsets: Optional[Dict[Optional[str], int]] = None  # built on first add
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, offset: int) -> Optional[str]:
+        return self.strings[offset]
+
+    def add(self, string: Optional[str]) -> int:
+        if self._offsets is None:
+            self._offsets = {string: i for i, string in enumerate(self.strings)}
+        offset = self._offsets.get(string)
+        if offset is None:
+            offset = self._offsets[string] = len(self.strings)
+            self.strings.append(string)
+        return offset
+
+
+class RecordStore(Mapping):
+    """Columnar storage of records, mapping of ids to GeoRecord views.
+    Every record is a row of parallel arrays: id, type code, parent row and offsets
+    of its names in table of interned strings. Addresses, streets, etc. share names.
+    Rows are never deleted: removed records aren't iterated, but they can be still read
+    by id, as ids of previous generations of engine may point to them"""
+
+    def __init__(self):
+        # rows by id: array for dense ids from csv, dict for negative fixups and sparse ones
+        self._dense = array("i")
+        self._sparse: Dict[int, int] = {}
+        self.ids = array("i")
+        self.types = array("B")
+        self.parents = array("i")
+        self.names = array("I")  # FIELDS per row: name, old_name for each language
+        self.strings = Strings()
+        # row: parent item, which isn't added as record yet
+        self._pending: Dict[int, GeoItem] = {}
+        self._removed: Set[int] = set()  # ids of removed records
+        self._dead = 0  # rows of removed records, and previous rows of added again ones
+        # live children of each row, counted on first `has_children` and kept up to date
+        self._child_counts: Optional[array] = None
+
+    def __len__(self):
+        return len(self.ids) - self._dead
+
+    def __iter__(self):
+        if not self._dead:
+            return iter(self.ids)
+        return (self.ids[row] for row in range(len(self.ids)) if self._alive(row))
+
+    def __contains__(self, id_):
+        return self.find(id_) is not None
+
+    def __getitem__(self, id_: int) -> GeoRecord:
+        row = self.row(id_)
+        if row is None:
+            raise KeyError(id_)
+        return GeoRecord._view(id_, row, self)
+
+    @property
+    def info(self):
+        return {"records": len(self), "unique_strings": len(self.strings) - 1}
+
+    def row(self, id_: int) -> Optional[int]:
+        if 0 <= id_ < len(self._dense):
+            row = self._dense[id_]
+            if row != NO_ROW:
+                return row
+        return self._sparse.get(id_)
+
+    def find(self, id_: int) -> Optional[int]:
+        """Row of record, which isn't removed"""
+        return None if id_ in self._removed else self.row(id_)
+
+    def _alive(self, row: int) -> bool:
+        id_ = self.ids[row]
+        return id_ not in self._removed and self.row(id_) == row
+
+    def dead_rows(self) -> List[int]:
+        return [row for row in range(len(self.ids)) if not self._alive(row)] if self._dead else []
+
+    def _set_row(self, id_: int, row: int) -> None:
+        if 0 <= id_ <= 2 * len(self.ids) + DENSE_SLACK:
+            if id_ >= len(self._dense):
+                self._dense.extend([NO_ROW] * (id_ + 1 - len(self._dense)))
+            self._dense[id_] = row
+        else:
+            self._sparse[id_] = row
+
+    def append(self, id_: int, item: GeoItem) -> int:
+        """Add row of item, its parent can be record or item. Removed id gets new row"""
+        self._removed.discard(id_)
+        row = len(self.ids)
+        self.ids.append(id_)
+        self.types.append(item.code)
+        self.parents.append(NO_ROW)
+        if self._child_counts is not None:
+            self._child_counts.append(0)
+        for name in item:
+            self.names.extend(map(self.strings.add, name))
+        self._set_row(id_, row)
+        self.set_parent(row, item.parent)
+        return row
+
+    def set_parent(self, row: int, parent: AnyGeo) -> None:
+        self._pending.pop(row, None)
+        previous = self.parents[row]
+        if isinstance(parent, GeoRecord):
+            self.parents[row] = parent._row
+        elif parent is not None and parent._row is not None:  # item of record
+            self.parents[row] = parent._row
+        else:
+            self.parents[row] = NO_ROW
+            if parent is not None:
+                self._pending[row] = parent
+
+        counts = self._child_counts
+        if counts is not None:
+            if previous != NO_ROW:
+                counts[previous] -= 1
+            if self.parents[row] != NO_ROW:
+                counts[self.parents[row]] += 1
+
+    def replace(self, id_: int, item: GeoItem) -> None:
+        """Change type, names and parent of record in place, keeping links of its children"""
+        row = self.find(id_)
+        if row is None:
+            raise KeyError(id_)
+        self.types[row] = item.code
+        offsets = [self.strings.add(value) for name in item for value in name]
+        self.names[row * FIELDS : (row + 1) * FIELDS] = array("I", offsets)
+        self.set_parent(row, item.parent)
+
+    def remove(self, id_: int) -> None:
+        """Remove record, its row is kept for readers, who found its id before"""
+        row = self.find(id_)
+        if row is None:
+            raise KeyError(id_)
+        self._removed.add(id_)
+        self._dead += 1
+        if self._child_counts is not None and self.parents[row] != NO_ROW:
+            self._child_counts[self.parents[row]] -= 1
+
+    def has_children(self, id_: int) -> bool:
+        """Check if record is a parent of records, which aren't removed"""
+        if self._child_counts is None:
+            counts = array("I", [0]) * len(self.ids)
+            for row, parent in enumerate(self.parents):
+                if parent != NO_ROW and self._alive(row):
+                    counts[parent] += 1
+            self._child_counts = counts
+        return self._child_counts[self.row(id_)] > 0
+
+    def item(self, row: int) -> GeoItem:
+        return TYPES[self.types[row]]._view(row, self)
+
+    def name(self, row: int, lang: int) -> Name:
+        i = (row * LANGS + lang) * 2
+        return Name(self.strings[self.names[i]], self.strings[self.names[i + 1]])
+
+    def parent(self, row: int) -> AnyGeo:
+        parent = self.parents[row]
+        if parent == NO_ROW:
+            return self._pending.get(row)
+        return GeoRecord._view(self.ids[parent], parent, self)
+
+    def type_of(self, id_: int) -> str:
+        """Same as `self[id_].item.type`, without creating views"""
+        return TYPES[self.types[self.row(id_)]].type
+
+    def parent_id(self, id_: int) -> Optional[int]:
+        """Id of resolved parent record, or None"""
+        parent = self.parents[self.row(id_)]
+        return None if parent == NO_ROW else self.ids[parent]
+
+    def dump(self) -> tuple:
+        """Return columns of store, without rows of removed records"""
+        if self._pending:
+            raise ValueError(f"Parents of {len(self._pending)} records aren't resolved")
+        if not self._dead:
+            return self.ids, self.types, self.parents, self.names, self.strings.strings
+
+        alive = [row for row in range(len(self.ids)) if self._alive(row)]
+        new_rows = {row: new_row for new_row, row in enumerate(alive)}
+        parents = (new_rows.get(self.parents[row], NO_ROW) for row in alive)
+        names = (self.names[row * FIELDS + i] for row in alive for i in range(FIELDS))
+        return (
+            array("i", (self.ids[row] for row in alive)),
+            array("B", (self.types[row] for row in alive)),
+            array("i", parents),
+            array("I", names),
+            self.strings.strings,
+        )
+
+    def load(self, state: tuple) -> None:
+        """Add dumped records, the ones which are already in store should be the same"""
+        ids, types, parents, names, strings = state
+        self._child_counts = None  # counted again, when they're needed
+        if not self:
+            self.ids, self.types, self.parents, self.names = ids, types, parents, names
+            self.strings = Strings(strings)
+            for row, id_ in enumerate(ids):
+                self._set_row(id_, row)
+            return
+
+        added = []
+        for row, id_ in enumerate(ids):
+            row_names = [strings[i] for i in names[row * FIELDS : (row + 1) * FIELDS]]
+            existing = self.find(id_)
+            if existing is None:
+                added.append(row)
+                self._set_row(id_, len(self.ids))
+                self.ids.append(id_)
+                self.types.append(types[row])
+                self.parents.append(NO_ROW)
+                self.names.extend(map(self.strings.add, row_names))
+            elif types[row] != self.types[existing] or row_names != [
+                self.strings[i] for i in self.names[existing * FIELDS : (existing + 1) * FIELDS]
+            ]:
+                raise ValueError(f"Collision with existing {self[id_]}: {id_}")
+        for row in added:
+            if parents[row] != NO_ROW:
+                self.parents[self.row(ids[row])] = self.row(ids[parents[row]])
+
+
+GeoRecord.registry = RecordStore()
+
+
 class Region(GeoItem):
     @classmethod
     def parse(cls, *names: LangNames):
@@ -234,3 +526,7 @@ class Address(GeoItem):
         *init, address = names
         parent = Street.parse(*init)
         return cls(address, parent)
+
+
+# GeoItem classes by type code
+TYPES = tuple(GeoMeta.registry.values())
@@ -0,0 +1,136 @@
+"""
+Alternative spellings of query: other keyboard layouts and transliteration
+
+Query typed in latin keyboard layout is translated into cyrillic layouts as a whole.
+Transliteration is ambiguous (`i` may be `і`, `ї`, `и` or `й`), so instead of
+generating all spellings, trie is walked with all alternatives at once, keeping
+only the ones which lead to existing nodes.
+
+Candidates are checked by walking the trie only, so ids are collected just for
+the layout which is actually used.
+"""
+
+from typing import Any, Iterator, List, Optional, Tuple
+
+from .trie import LATIN, preprocess_words
+
+# latin to cyrillic keyboard layout map
+keymap_ru = str.maketrans(
+    r"qwertyuiop[]asdfghjkl;'zxcvbnm,./", r"йцукенгшщзхъфывапролджэячсмитьбю."
+)
+keymap_uk = str.maketrans(
+    r"qwertyuiop[]\asdfghjkl;'zxcvbnm,./", r"йцукенгшщзхїґфівапролджєячсмитьбю."
+)
+KEYMAPS = {"uk": keymap_uk, "ru": keymap_ru}  # ? language preference can be specified somewhere
+TRANSLIT = "translit"
+
+# latin letters: cyrillic alternatives, most likely first, from ukrainian and russian romanization,
+# soft sign is usually omitted
+TRANSLIT_MAP = {
+    "shch": ["щ"],
+    "sch": ["щ"],
+    "zgh": ["зг"],
+    "kh": ["х"],
+    "zh": ["ж"],
+    "ts": ["ц", "тс", "ць"],
+    "ch": ["ч"],
+    "sh": ["ш"],
+    "ye": ["є", "е"],
+    "yi": ["ї", "ий"],
+    "yu": ["ю"],
+    "ya": ["я"],
+    "yo": ["е", "йо"],
+    "ie": ["є", "іе"],
+    "iu": ["ю", "іу"],
+    "ia": ["я", "ія"],
+    "a": ["а"],
+    "b": ["б"],
+    "c": ["ц", "к"],
+    "d": ["д", "дь"],
+    "e": ["е", "є", "э"],
+    "f": ["ф"],
+    "g": ["г"],
+    "h": ["г", "х"],
+    "i": ["і", "и", "ї", "й"],
+    "j": ["й"],
+    "k": ["к"],
+    "l": ["л", "ль"],
+    "m": ["м"],
+    "n": ["н", "нь"],
+    "o": ["о"],
+    "p": ["п"],
+    "q": ["к"],
+    "r": ["р", "рь"],
+    "s": ["с", "сь"],
+    "t": ["т", "ть"],
+    "u": ["у"],
+    "v": ["в"],
+    "w": ["в"],
+    "x": ["кс"],
+    "y": ["и", "й", "ы"],
+    "z": ["з", "зь"],
+}
+TOKEN_SIZES = sorted({len(token) for token in TRANSLIT_MAP}, reverse=True)
+MAX_STATES = 64  # partial transliterations kept per word
+
+
+def _node_key(node) -> int:
+    """Nodes of packed trie are numbers, and dict trie nodes are unhashable"""
+    return node if isinstance(node, int) else id(node)
+
+
+def translit_nodes(index, word: str) -> List[Tuple[Any, str]]:
+    """Walk the trie with all transliterations of latin word at once.
+    Return found nodes with their cyrillic words, most likely first"""
+    found = []
+    states = [(index.walk(""), 0, "")]  # node, position in word, cyrillic prefix
+    seen = set()
+    while states:
+        next_states = []
+        for node, pos, text in states:
+            if pos == len(word):
+                found.append((node, text))
+                continue
+            for size in TOKEN_SIZES:
+                for letters in TRANSLIT_MAP.get(word[pos : pos + size], ()):
+                    child = index.walk(letters, node)
+                    key = (_node_key(child), pos + size)
+                    if child is not None and key not in seen:
+                        seen.add(key)
+                        next_states.append((child, pos + size, text + letters))
+        states = next_states[:MAX_STATES]
+    return found
+
+
+def transliterate(index, query: str) -> Optional[str]:
+    """Return the most likely cyrillic spelling of latin query, with all words in trie"""
+    words = []
+    for word in preprocess_words(query):
+        if len(LATIN.findall(word)) < len(word):
+            words.append(word)  # not a latin word, keep as is
+            continue
+        nodes = translit_nodes(index, word)
+        if not nodes:
+            return None
+        words.append(nodes[0][1])
+    return " ".join(words) if words else None
+
+
+def candidates(index, query: str) -> Iterator[Tuple[str, str]]:
+    """Yield layout names and translated queries, which may have results.
+    Index without trie nodes can't be checked, so all keyboard layouts are yielded"""
+    can_walk = hasattr(index, "walk")
+    for layout, keymap in KEYMAPS.items():
+        translated = query.translate(keymap)
+        if not can_walk or all(
+            index.walk(word) is not None for word in preprocess_words(translated)
+        ):
+            yield layout, translated
+
+    if can_walk and LATIN.search(query.lower()):
+        translated = transliterate(index, query)
+        if translated:
+            yield TRANSLIT, translated
+
+
+__all__ = ["KEYMAPS", "keymap_ru", "keymap_uk", "candidates", "transliterate"]
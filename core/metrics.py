@@ -0,0 +1,173 @@
+"""
+Low-overhead metrics of search stages: latency histograms, result sizes and cache hits
+
+Stages are timed inline with monotonic clock, `start = clock()` ... `observe(stage, start)`,
+or by decorating whole functions with `timed(stage)`. Disabled metrics (the default)
+return zero start and skip observing, so the cost is a couple of calls per stage.
+Histograms have fixed buckets, and are rendered in Prometheus text format, or as
+summary table for CLI. Updates aren't locked, so concurrent threads may rarely lose
+an observation, and every process of pre-fork server keeps its own metrics.
+"""
+
+import os
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from .cache import ResultCache
+
+PREFIX = "key"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from 10us to 10s
+# fmt: off
+STAGE_BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# fmt: on
+# number of records
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 1000, 10_000, 100_000)
+
+
+class Histogram:
+    __slots__ = ["bounds", "counts", "sum"]
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is above all bounds
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1  # bounds are inclusive
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of bucket with q-th value, inf when it's above all bounds"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def lines(self, name: str, labels: str) -> Iterator[str]:
+        """Cumulative buckets, sum and count in Prometheus format"""
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):  # type: ignore
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+
+    def clock(self) -> float:
+        """Start of stage, zero when disabled"""
+        return perf_counter() if self.enabled else 0.0
+
+    def observe(self, stage: str, start: float) -> None:
+        """Record duration of stage, started at `clock()`"""
+        if start:
+            elapsed = perf_counter() - start
+            try:
+                self.stages[stage].observe(elapsed)
+            except KeyError:
+                self.stages.setdefault(stage, Histogram(STAGE_BUCKETS)).observe(elapsed)
+
+    def size(self, name: str, value: int) -> None:
+        """Record size of result set"""
+        if self.enabled:
+            try:
+                self.sizes[name].observe(value)
+            except KeyError:
+                self.sizes.setdefault(name, Histogram(SIZE_BUCKETS)).observe(value)
+
+    def timed(self, stage: Optional[str] = None) -> Callable[[Callable], Callable]:
+        """Decorator to record duration of function calls, named after function by default"""
+
+        def decorator(f: Callable) -> Callable:
+            name = stage or f.__qualname__
+
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = self.clock()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(name, start)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self) -> None:
+        self.stages.clear()
+        self.sizes.clear()
+
+    def render(self, caches: Optional[Dict[str, ResultCache]] = None) -> str:
+        """Metrics and cache counters in Prometheus text format"""
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent in search stages",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            lines.extend(histogram.lines(f"{PREFIX}_stage_seconds", f'stage="{stage}"'))
+        lines += [
+            f"# HELP {PREFIX}_result_size Number of found records",
+            f"# TYPE {PREFIX}_result_size histogram",
+        ]
+        for name, histogram in sorted(self.sizes.items()):
+            lines.extend(histogram.lines(f"{PREFIX}_result_size", f'result="{name}"'))
+
+        caches = caches or {}
+        for key, kind, help_ in (
+            ("hits", "counter", "Cache hits"),
+            ("misses", "counter", "Cache misses"),
+            ("evictions", "counter", "Cache evictions"),
+            ("entries", "gauge", "Cached entries"),
+        ):
+            name = f"{PREFIX}_cache_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+            lines.extend(f'{name}{{cache="{c}"}} {cache.info[key]}' for c, cache in caches.items())
+        return "\n".join(lines) + "\n"
+
+    def summary(self, caches: Optional[Dict[str, ResultCache]] = None) -> str:
+        """Table of stages and cache hit ratios, for CLI"""
+        lines = [f"{'Stage':<24}{'Calls':>8}{'Total, s':>11}{'Mean, ms':>11}{'P99, ms':>10}"]
+        for stage, h in sorted(self.stages.items()):
+            mean = h.sum / h.count * 1000
+            p99 = h.quantile(0.99) * 1000
+            lines.append(f"{stage:<24}{h.count:>8}{h.sum:>11.3f}{mean:>11.3f}{p99:>10.2f}")
+        for name, h in sorted(self.sizes.items()):
+            lines.append(f"Found by {name}: {h.sum / h.count:.1f} records in {h.count} queries")
+        for name, cache in (caches or {}).items():
+            info = cache.info
+            lines.append(f"Cache {name}: {info['hits']} hits, hit ratio {info['hit_ratio']}")
+        return "\n".join(lines)
+
+
+# global metrics of this process, switched on by env variable or `enable`
+registry = Metrics(enabled=os.getenv("METRICS", "0") not in ("", "0"))
+clock = registry.clock
+observe = registry.observe
+size = registry.size
+timed = registry.timed
+render = registry.render
+summary = registry.summary
+
+
+def enable(enabled: bool = True) -> None:
+    registry.enabled = enabled
+
+
+__all__ = ["Histogram", "Metrics", "registry", "enable", "clock", "observe", "size", "timed"]
@@ -0,0 +1,200 @@
+"""
+Packed read-only trie, stored in a file which can be memory-mapped
+
+Nodes are numbered in depth-first preorder, so every subtree is a continuous range
+of node numbers [node, subtree_end[node]), and item ids of the whole subtree are
+a continuous range of postings too. All tables are flat arrays of 4-byte integers:
+
+    edges_off[N + 1]   range of node edges in edge_char/edge_child
+    edge_char[E]       edge character codepoint, sorted within node
+    edge_child[E]      child node number
+    subtree_end[N]     first node number after node subtree
+    items_off[N + 1]   range of node ids in items (whole words)
+    suffix_off[N + 1]  range of node ids in suffix (word suffixes)
+    items[I]
+    suffix[S]
+
+Workers that map the same file share one physical copy through the page cache.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Iterator, List, Optional, Tuple
+
+from . import metrics, postings, trie, utils
+
+MAGIC = b"KEYP"
+VERSION = 1
+# magic, version, byteorder, nodes, edges, items, suffix, indexed
+HEADER = struct.Struct("<4sHHIIIII")
+BYTEORDER = {"little": 0, "big": 1}[sys.byteorder]
+TABLES = (
+    "edges_off",
+    "edge_char",
+    "edge_child",
+    "subtree_end",
+    "items_off",
+    "suffix_off",
+    "items",
+    "suffix",
+)
+IDS_TABLES = {"items", "suffix"}  # signed, because of negative fixup ids
+
+
+def _pack_nodes(root: dict):
+    """Flatten dict trie into preorder tables"""
+    edges_off, edge_char, edge_child = array("I"), array("I"), array("I")
+    subtree_end, items_off, suffix_off = array("I"), array("I"), array("I")
+    items, suffix = array("i"), array("i")
+
+    def visit(node: dict) -> int:
+        n = len(subtree_end)
+        subtree_end.append(0)  # filled after children are visited
+        items_off.append(len(items))
+        suffix_off.append(len(suffix))
+        items.extend(node.get(trie.ITEMSKEY, ()))
+        suffix.extend(node.get(trie.SUFFIXKEY, ()))
+
+        chars = sorted(key for key in node if key not in trie.KEYS)
+        first = len(edge_char)
+        edges_off.append(first)
+        edge_char.extend(map(ord, chars))
+        edge_child.extend([0] * len(chars))
+        for i, c in enumerate(chars):
+            edge_child[first + i] = visit(node[c])
+
+        subtree_end[n] = len(subtree_end)
+        return n
+
+    visit(root)
+    edges_off.append(len(edge_char))
+    items_off.append(len(items))
+    suffix_off.append(len(suffix))
+    return edges_off, edge_char, edge_child, subtree_end, items_off, suffix_off, items, suffix
+
+
+def pack(root: dict, path, indexed: int = 0) -> None:
+    """Write dict trie into packed file"""
+    tables = _pack_nodes(root)
+    edges_off, edge_char, _, subtree_end, _, _, items, suffix = tables
+    with open(path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                BYTEORDER,
+                len(subtree_end),
+                len(edge_char),
+                len(items),
+                len(suffix),
+                indexed,
+            )
+        )
+        for table in tables:
+            table.tofile(f)
+
+
+class PackedTrie:
+    """Read-only trie over memory-mapped packed file, with the same lookup interface as Trie"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, nodes, edges, items, suffix, indexed = HEADER.unpack_from(
+            self._mmap
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a packed trie v{VERSION} file: {path}")
+        if byteorder != BYTEORDER:
+            raise ValueError(f"Packed trie has different byte order: {path}")
+        self._nodes, self._indexed_items = nodes, indexed
+
+        sizes = (nodes + 1, edges, edges, nodes, nodes + 1, nodes + 1, items, suffix)
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        for name, size in zip(TABLES, sizes):
+            fmt = "i" if name in IDS_TABLES else "I"
+            end = offset + 4 * size
+            setattr(self, f"_{name}", view[offset:end].cast(fmt))
+            offset = end
+
+    @property
+    def indexed(self):
+        return self._indexed_items
+
+    @property
+    def info(self):
+        return {
+            "prefix_nodes": self._nodes - 1,
+            "georecord_items": len(self._items),
+            "suffix_items": len(self._suffix),
+            "indexed": self.indexed,
+            "size_mapped": utils.sizeof_fmt(len(self._mmap)),
+        }
+
+    def add(self, record, words=None):
+        raise TypeError(f"Packed trie is read-only: {self.path}")
+
+    def child(self, node: int, c: str) -> int:
+        """Return child node number for character, or -1"""
+        lo, hi = self._edges_off[node], self._edges_off[node + 1]
+        code = ord(c)
+        i = bisect_left(self._edge_char, code, lo, hi)
+        if i < hi and self._edge_char[i] == code:
+            return self._edge_child[i]
+        return -1
+
+    def walk(self, word: str, node: Optional[int] = None) -> Optional[int]:
+        """Return node number of word, moving down from node (root by default), or None"""
+        node = node or 0
+        for c in word:
+            node = self.child(node, c)
+            if node < 0:
+                return None
+        return node
+
+    def node_ids(self, node: int, exact: bool = False) -> postings.Postings:
+        """Collect items ids of node, returned by `walk`"""
+        return self.collect(exact, node)
+
+    def children(self, node: int) -> Iterator[Tuple[str, int]]:
+        """Iterate over characters and child node numbers of node"""
+        lo, hi = self._edges_off[node], self._edges_off[node + 1]
+        return zip(map(chr, self._edge_char[lo:hi]), self._edge_child[lo:hi])
+
+    def collect(self, exact: bool, node: int = 0) -> postings.Postings:
+        """Collect items of node subtree into postings"""
+        end = self._subtree_end[node]
+        ids = self._items[self._items_off[node] : self._items_off[end]]
+        if not exact:
+            ids = chain(ids, self._suffix[self._suffix_off[node] : self._suffix_off[end]])
+        return postings.make(ids)
+
+    def lookup(self, query: str, exact: bool = False) -> List[postings.Postings]:
+        """Move down from root node, following query, and collect items ids for each word"""
+        if not query:
+            return []
+
+        start = metrics.clock()
+        words = trie.preprocess_words(query)
+        metrics.observe("preprocess_words", start)
+
+        word_ids: List[postings.Postings] = []
+        for word in words:
+            start = metrics.clock()
+            node = self.walk(word)
+            metrics.observe("trie_descent", start)
+            start = metrics.clock()
+            word_ids.append(postings.EMPTY if node is None else self.collect(exact, node))
+            metrics.observe("collect", start)
+
+        return word_ids
+
+
+__all__ = ["pack", "PackedTrie"]
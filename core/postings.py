@@ -0,0 +1,165 @@
+"""
+Postings - sorted unique integer ids, stored as array('i')
+
+Compact replacement for lists and sets of ids: 4 bytes per id instead of
+pointer + int object. Arrays returned from trie may be shared with its nodes,
+so they're never modified in place, all operations return new arrays.
+Sorted arrays are intersected by galloping merge: each side skips by binary search
+to the current id of other one, so runs of ids without matches are skipped at once.
+Longer ones are searched in each other with optional numpy at once, without converting
+ids to python ints, as hashing them into sets would do.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from typing import Iterable
+
+try:
+    import numpy as np
+except ImportError:  # optional, postings are merged in python
+    np = None
+
+TYPECODE = "i"
+# shorter postings from this length are merged by numpy, if it's installed
+NUMPY_MIN = 32
+
+Postings = array
+
+EMPTY = array(TYPECODE)
+
+
+def make(ids: Iterable[int]) -> Postings:
+    """Create postings from any ids"""
+    return array(TYPECODE, sorted(set(ids)))
+
+
+def insert(ids: Postings, id_: int) -> None:
+    """Insert id into postings in place, if it's not there yet"""
+    i = bisect_left(ids, id_)
+    if i == len(ids) or ids[i] != id_:
+        ids.insert(i, id_)
+
+
+def remove(ids: Postings, id_: int) -> None:
+    """Remove id from postings in place, if it's there"""
+    i = bisect_left(ids, id_)
+    if i < len(ids) and ids[i] == id_:
+        del ids[i]
+
+
+def contains(ids: Postings, id_: int) -> bool:
+    """Check if id is in postings by binary search"""
+    i = bisect_left(ids, id_)
+    return i < len(ids) and ids[i] == id_
+
+
+def _found(ids, other):
+    """Mask of numpy ids, which are found in other sorted ones"""
+    i = np.searchsorted(other, ids)
+    i[i == len(other)] = 0
+    return other[i] == ids
+
+
+def _from_numpy(ids) -> Postings:
+    res = array(TYPECODE)
+    res.frombytes(ids.tobytes())
+    return res
+
+
+def _merged(a: Postings, b: Postings, found: bool) -> Postings:
+    """Ids of a, which are found or not found in b, merged by numpy"""
+    ids = np.frombuffer(a, dtype=np.intc)
+    mask = _found(ids, np.frombuffer(b, dtype=np.intc))
+    return _from_numpy(ids[mask if found else ~mask])
+
+
+def _intersect(a: Postings, b: Postings) -> Postings:
+    """Merge two postings, skipping ids without match in the other one by binary search"""
+    if np is not None and len(a) >= NUMPY_MIN:
+        return _merged(a, b, found=True)
+    res = array(TYPECODE)
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a:
+        id_ = a[i]
+        j = bisect_left(b, id_, j)
+        if j == len_b:
+            break
+        if b[j] == id_:
+            res.append(id_)
+            i += 1
+            j += 1
+        else:
+            i = bisect_left(a, b[j], i + 1)
+    return res
+
+
+def intersection(*postings: Postings) -> Postings:
+    """Intersect postings, starting from the shortest"""
+    if not postings:
+        return EMPTY
+    res, *others = sorted(postings, key=len)
+    for other in others:
+        if not res:
+            break
+        res = _intersect(res, other)
+    return res
+
+
+def union(*postings: Postings) -> Postings:
+    """Merge postings into one"""
+    postings = tuple(filter(None, postings))
+    if len(postings) == 1:
+        return postings[0]
+    return make(chain(*postings))
+
+
+def at_least(count: int, *postings: Postings) -> Postings:
+    """Return ids, found in at least `count` of postings"""
+    if np is not None and sum(map(len, postings)) >= NUMPY_MIN:
+        # ids are unique in each postings, so id repeated `count` times in a row is found
+        ids = np.sort(np.concatenate([np.frombuffer(p, dtype=np.intc) for p in postings]))
+        repeated = ids[count - 1 :] == ids[: len(ids) - count + 1]
+        return _from_numpy(np.unique(ids[count - 1 :][repeated]))
+    counter = Counter(chain(*postings))
+    return array(TYPECODE, sorted(id_ for id_, n in counter.items() if n >= count))
+
+
+def difference(a: Postings, b: Postings) -> Postings:
+    """Return ids from a, which are not in b"""
+    if not a or not b:
+        return a
+    if np is not None and min(len(a), len(b)) >= NUMPY_MIN:
+        return _merged(a, b, found=False)
+    res = array(TYPECODE)
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a:
+        j = bisect_left(b, a[i], j)
+        if j == len_b:
+            break
+        if b[j] == a[i]:
+            i += 1
+            j += 1
+        else:
+            # ids of a before the next id of b are kept as a slice
+            k = bisect_left(a, b[j], i + 1)
+            res.extend(a[i:k])
+            i = k
+    res.extend(a[i:])
+    return res
+
+
+__all__ = [
+    "Postings",
+    "make",
+    "insert",
+    "remove",
+    "contains",
+    "intersection",
+    "union",
+    "at_least",
+    "difference",
+]
@@ -0,0 +1,68 @@
+"""
+Binary snapshot of the built search index
+
+Snapshot consists of fixed header and pickled payload:
+    magic (4 bytes) | format version (uint16) | pickle protocol (uint16) | payload
+
+Payload keeps already built structures (trie nodes with id lists, address numbers), and columns of
+GeoRecord registry, so loading doesn't parse or normalize names again.
+Snapshots are trusted local files, never load ones received from untrusted sources.
+"""
+
+import gc
+import pickle
+import struct
+from typing import Any, Dict
+
+from . import geo
+
+MAGIC = b"KEYS"
+VERSION = 7
+PROTOCOL = pickle.HIGHEST_PROTOCOL
+HEADER = struct.Struct("<4sHH")
+
+
+def is_snapshot(path) -> bool:
+    """Check if file starts with snapshot magic bytes"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def pack_records(index: geo.RecordStore) -> tuple:
+    """Return columns of record store"""
+    return index.dump()
+
+
+def unpack_records(columns: tuple, index: geo.RecordStore) -> None:
+    """Load records from columns into record store"""
+    index.load(columns)
+
+
+def save(path, state: Dict[str, Any]) -> None:
+    """Write state into versioned snapshot file"""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, PROTOCOL))
+        pickle.dump(state, f, protocol=PROTOCOL)
+
+
+def load(path) -> Dict[str, Any]:
+    """Read state from snapshot file, checking its version"""
+    with open(path, "rb") as f:
+        magic, version, protocol = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a snapshot file: {path}")
+        if version != VERSION or protocol > pickle.HIGHEST_PROTOCOL:
+            raise ValueError(f"Unsupported snapshot version {version}/{protocol}: {path}")
+
+        # millions of small containers are created at once, and none of them are garbage
+        # (pre-fork server disables gc for the whole build, it stays disabled then)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.load(f)
+        finally:
+            if enabled:
+                gc.enable()
+
+
+__all__ = ["is_snapshot", "save", "load"]
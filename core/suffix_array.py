@@ -0,0 +1,213 @@
+"""
+Suffix array implementation for substring search, alternative to all-suffixes trie
+
+Unique normalized words are concatenated into one buffer, separated by SEP.
+Suffix array keeps start positions of all word suffixes sorted by suffix, so all
+suffixes starting with query are in one range, found by binary search. LCP array
+(longest common prefix with previous suffix) gives the end of that range.
+Positions are mapped back to words, and words - to record ids.
+"""
+
+import time
+from array import array
+from copy import copy
+from itertools import chain
+from typing import Dict, List, Optional, Set
+
+from . import geo, postings, utils
+from .trie import item_words, preprocess_words
+
+SEP = "\0"
+# rebuild suffix array, when there are more new words than this part of indexed ones,
+# until then new words are scanned one by one
+REBUILD_RATIO = 0.25
+REBUILD_MIN = 1000
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class SuffixArrayIndex:
+    def __init__(self):
+        self._words: Dict[str, int] = {}  # word: word number
+        self._word_list: List[str] = []  # words by number
+        self._word_ids: List[postings.Postings] = []  # ids of records with word
+        self._indexed_items = 0
+        self._build_time = 0.0
+        # numbers of words with postings, which can be changed in place. None if none are shared
+        self._owned: Optional[Set[int]] = None
+        self._set_arrays("", array("I"), array("I"), array("I"), array("I"))
+
+    def _set_arrays(self, buffer: str, starts: array, sa: array, sa_word: array, lcp: array):
+        self._buffer = buffer
+        self._starts = starts  # buffer position of each indexed word
+        self._sa = sa  # buffer positions of suffixes, sorted by suffix
+        self._sa_word = sa_word  # word number of each suffix
+        self._lcp = lcp  # common prefix length with previous suffix
+        self._built = len(starts)  # words after that are new, not in suffix array yet
+
+    def dump(self) -> tuple:
+        """Return index state, built from plain containers only"""
+        arrays = self._buffer, self._starts, self._sa, self._sa_word, self._lcp
+        return self._word_list, self._word_ids, self._indexed_items, arrays
+
+    @classmethod
+    def restore(cls, state: tuple) -> "SuffixArrayIndex":
+        """Create index from previously dumped state"""
+        obj = cls.__new__(cls)
+        obj._word_list, obj._word_ids, obj._indexed_items, arrays = state
+        obj._words = {word: n for n, word in enumerate(obj._word_list)}
+        obj._build_time = 0.0
+        obj._owned = None
+        obj._set_arrays(*arrays)
+        return obj
+
+    def fork(self) -> "SuffixArrayIndex":
+        """Return new index for adding items, sharing words and arrays with this one.
+        Postings of words are copied on first write, in both indexes, and arrays are
+        replaced on build, so readers of this index don't see changes"""
+        obj = copy(self)
+        obj._words, obj._word_list, obj._word_ids = (
+            dict(self._words),
+            list(self._word_list),
+            list(self._word_ids),
+        )
+        obj._owned = set()
+        self._owned = set()  # everything is shared now
+        return obj
+
+    @property
+    def indexed(self):
+        return self._indexed_items
+
+    @property
+    def info(self):
+        words = len(self._word_ids)
+        ids = sum(map(len, self._word_ids))
+        return {
+            "words": words,
+            "words_pending": words - self._built,
+            "suffixes": len(self._sa),
+            "word_ids": ids,
+            "word_density": round(ids / words, 2) if words else 0,
+            "max_lcp": max(self._lcp, default=0),
+            "indexed": self.indexed,
+            "build_time": round(self._build_time, 2),
+            "size_buffer": utils.total_size(self._buffer),
+            "size_arrays": utils.total_size([self._starts, self._sa, self._sa_word, self._lcp]),
+            "size_itemkeys": utils.total_size(self._word_ids),
+            "size_words": utils.total_size(self._word_list),
+        }
+
+    def build(self) -> None:
+        """(Re)build suffix array for all words"""
+        start = time.perf_counter()
+        words = self._word_list
+        buffer = SEP.join(words) + SEP
+
+        starts = array("I")
+        position = 0
+        for word in words:
+            starts.append(position)
+            position += len(word) + 1
+
+        suffixes = sorted(
+            (word[i:], starts[n] + i, n) for n, word in enumerate(words) for i in range(len(word))
+        )
+        sa = array("I", (position for _, position, _ in suffixes))
+        sa_word = array("I", (n for _, _, n in suffixes))
+        lcp = array("I", [0])
+        lcp.extend(_common_prefix(a[0], b[0]) for a, b in zip(suffixes, suffixes[1:]))
+
+        self._set_arrays(buffer, starts, sa, sa_word, lcp)
+        self._build_time = time.perf_counter() - start
+
+    def prepare(self) -> None:
+        """Build suffix array after bulk indexing, and rebuild it when there are too many
+        new words, which are searched one by one, so small changes don't rebuild it.
+        Not called by lookups, as concurrent readers would see arrays replaced"""
+        pending = len(self._word_ids) - self._built
+        if pending and (not self._built or pending > max(REBUILD_MIN, REBUILD_RATIO * self._built)):
+            self.build()
+
+    def _range(self, word: str) -> range:
+        """Find range of suffix array with suffixes, starting with word"""
+        buffer, sa, m = self._buffer, self._sa, len(word)
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if buffer[sa[mid] : sa[mid] + m] < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(sa) or buffer[sa[lo] : sa[lo] + m] != word:
+            return range(0)
+
+        end, lcp = lo + 1, self._lcp
+        while end < len(sa) and lcp[end] >= m:
+            end += 1
+        return range(lo, end)
+
+    def _lookup_word(self, word: str, exact: bool) -> postings.Postings:
+        """Find numbers of words, which start with / contain word, and collect their ids"""
+        found = set()
+        for i in self._range(word):
+            n = self._sa_word[i]
+            if not exact or self._sa[i] == self._starts[n]:
+                found.add(n)
+
+        # new words aren't in suffix array yet
+        for n in range(self._built, len(self._word_list)):
+            new_word = self._word_list[n]
+            if new_word.startswith(word) if exact else word in new_word:
+                found.add(n)
+
+        return postings.make(chain.from_iterable(self._word_ids[n] for n in found))
+
+    def lookup(self, query: str, exact: bool = False) -> List[postings.Postings]:
+        """Collect items ids for each word of query, same as trie lookup"""
+        if not query:
+            return []
+
+        return [self._lookup_word(word, exact) for word in preprocess_words(query)]
+
+    def add(self, record: geo.GeoRecord, words: Optional[List[str]] = None) -> geo.GeoRecord:
+        """Add words of geo names in all languages, suffixes are indexed on build"""
+        for word in item_words(record.item) if words is None else words:
+            n = self._words.get(word)
+            if n is None:
+                n = self._words[word] = len(self._word_list)
+                self._word_list.append(word)
+                self._word_ids.append(postings.make(()))
+                if self._owned is not None:
+                    self._owned.add(n)
+            elif self._owned is not None and n not in self._owned:
+                # shared with forked index
+                self._word_ids[n] = array(postings.TYPECODE, self._word_ids[n])
+                self._owned.add(n)
+            postings.insert(self._word_ids[n], record.id)
+
+        self._indexed_items += 1
+        return record
+
+    def remove(self, record: geo.GeoRecord, words: Optional[List[str]] = None) -> None:
+        """Remove record from postings of its words, words are kept in suffix array"""
+        for word in item_words(record.item) if words is None else words:
+            n = self._words.get(word)
+            if n is None or not postings.contains(self._word_ids[n], record.id):
+                continue
+            if self._owned is not None and n not in self._owned:
+                # shared with forked index
+                self._word_ids[n] = array(postings.TYPECODE, self._word_ids[n])
+                self._owned.add(n)
+            postings.remove(self._word_ids[n], record.id)
+
+        self._indexed_items -= 1
+
+
+__all__ = ["SuffixArrayIndex"]
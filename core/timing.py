@@ -1,6 +1,6 @@
 import atexit
-from time import clock
 from functools import reduce
+from time import perf_counter
 
 
 def seconds_to_str(t):
@@ -14,7 +14,7 @@ line = "=" * 40
 
 def log(s, elapsed=None):
     print(line)
-    print(seconds_to_str(clock()), "-", s)
+    print(now(), "-", s)
     if elapsed:
         print("Elapsed time:", elapsed)
     print(line)
@@ -22,15 +22,16 @@ def log(s, elapsed=None):
 
 
 def endlog():
-    end = clock()
+    end = perf_counter()
     elapsed = end - start
     log("End Program", seconds_to_str(elapsed))
 
 
 def now():
-    return seconds_to_str(clock())
+    """Time since program start, `time.clock` was removed in python 3.8"""
+    return seconds_to_str(perf_counter() - start)
 
 
-start = clock()
+start = perf_counter()
 atexit.register(endlog)
 log("Start Program")
@@ -6,16 +6,22 @@ Keys should be unique, values - any alphanumeric sequences
 """
 
 import re
+import time
 from collections import defaultdict
+from copy import copy
 from functools import partial
 from itertools import chain
-from typing import Iterable, Iterator, List, Optional, Set
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from . import geo, utils
+from . import geo, metrics, postings, utils
 
 ITEMSKEY = "_items"
 SUFFIXKEY = "_suffix"
-KEYS = {ITEMSKEY, SUFFIXKEY}
+# precomputed ids of the whole subtree: items only, and items with suffixes
+SUBTREE_ITEMSKEY = "_subtree_items"
+SUBTREEKEY = "_subtree"
+SUBTREE_KEYS = {SUBTREE_ITEMSKEY, SUBTREEKEY}
+KEYS = {ITEMSKEY, SUFFIXKEY} | SUBTREE_KEYS
 
 # replace shifty characters for trie add/lookup only, not index
 SUB_MAP = str.maketrans("-ёґ", " ег", r"""{}()[]"'’,._<>:;!@#$%^&*+=""")  # from, to, remove
@@ -23,6 +29,10 @@ LATCYR_MAP = str.maketrans("etiopahkxcbm", "етіоранкхсвм")
 LATIN = re.compile("[a-z]")
 
 
+def new_postings() -> postings.Postings:
+    return postings.make(())
+
+
 def change_latin(word: str) -> str:
     if len(LATIN.findall(word)) < len(word):
         word = word.translate(LATCYR_MAP)
@@ -34,6 +44,12 @@ def preprocess_words(word: str) -> List[str]:
     return [change_latin(w) for w in word.lower().translate(SUB_MAP).split()] if word else []
 
 
+def item_words(item: geo.GeoItem) -> List[str]:
+    """Return normalized words of item names in all languages, including old names"""
+    # Name objects for different languages, Name is iterable namedtuple: name, old_name
+    return [word for lang_name in item for name in lang_name for word in preprocess_words(name)]
+
+
 def suffixes(word: str) -> Iterator[str]:
     """Return all suffixes of the word"""
     if not word:
@@ -49,42 +65,98 @@ def _collect(node: dict, exact: bool) -> Iterable[int]:
     return chain(suffixes, node.get(ITEMSKEY, []), *(_collect(node[key], exact) for key in keys))
 
 
-def collect(node: dict, exact: bool) -> Set[int]:
-    """Collect items on specified tree node into set"""
-    return set(_collect(node, exact))
+def collect(node: dict, exact: bool) -> postings.Postings:
+    """Collect items on specified tree node into postings"""
+    precomputed = node.get(SUBTREE_ITEMSKEY if exact else SUBTREEKEY)
+    if precomputed is not None:
+        return precomputed
+    return postings.make(_collect(node, exact))
+
+
+def _precompute(node: dict, depth: int) -> None:
+    """Recursively store sorted subtree ids in nodes up to depth, or remove them when depth is 0"""
+    for key in node.keys() - KEYS:
+        child = node[key]
+        if depth > 0:
+            child[SUBTREEKEY] = postings.make(_collect(child, exact=False))
+            child[SUBTREE_ITEMSKEY] = postings.make(_collect(child, exact=True))
+        elif SUBTREEKEY not in child:
+            continue  # deeper nodes weren't precomputed either
+        else:
+            del child[SUBTREEKEY], child[SUBTREE_ITEMSKEY]
+        _precompute(child, depth - 1)
+
+
+def _subtrees(node: dict) -> Iterator[postings.Postings]:
+    """Recursively iterate over precomputed subtree ids, shared nodes are repeated"""
+    for key in node.keys() - KEYS:
+        child = node[key]
+        if SUBTREEKEY in child:
+            yield child[SUBTREEKEY]
+            yield child[SUBTREE_ITEMSKEY]
+            yield from _subtrees(child)
+
+
+def _precompute_timing(node: dict) -> dict:
+    """Compare collect time on precomputed first level nodes with recursive walk"""
+    nodes = [node[key] for key in node.keys() - KEYS]
+    start = time.perf_counter()
+    for child in nodes:
+        postings.make(_collect(child, exact=False))
+    walk = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for child in nodes:
+        collect(child, exact=False)
+    precomputed = time.perf_counter() - start
+    return {
+        "collect_walk_ms": round(walk * 1000, 2),
+        "collect_precomputed_ms": round(precomputed * 1000, 2),
+    }
 
 
 def _show(node: dict, prefix=""):
     """Recursively simple-print trie structure"""
     print(prefix)
     for key, value in node.items():
-        if key in {ITEMSKEY, SUFFIXKEY}:
+        if key in KEYS:
             print(f"{prefix}{key}: {value}")
         else:
             _show(value, prefix + key)
 
 
-def _analyze(node: dict, depth=0, info=defaultdict(int)):
-    """Helper that recursively collects tree info - node counts"""
-    info["depth"] = max(info["depth"], depth)
-    for key in node.keys():
+def _analyze(node: dict, info: dict, heights: Dict[int, int]) -> int:
+    """Helper that recursively collects tree info - node counts.
+    Nodes shared between branches (DAWG) are counted once. Return height of the node
+    """
+    height = 0
+    for key, value in node.items():
         if key == ITEMSKEY:
             info["georecord_containers"] += 1
-            info["georecord_items"] += len(node[key])
+            info["georecord_items"] += len(value)
         elif key == SUFFIXKEY:
             info["suffix_containers"] += 1
-            info["suffix_items"] += len(node[key])
+            info["suffix_items"] += len(value)
+        elif key in SUBTREE_KEYS:
+            info["subtree_containers"] += 1
+            info["subtree_items"] += len(value)
         else:
-            info["prefix_nodes"] += 1
-            _analyze(node[key], depth + 1, info)
-    return info
+            child_height = heights.get(id(value))
+            if child_height is None:
+                info["prefix_nodes"] += 1
+                child_height = heights[id(value)] = _analyze(value, info, heights)
+            else:
+                info["shared_edges"] += 1
+            height = max(height, child_height + 1)
+    return height
 
 
 def analyze(node: dict, sizes=False):
     """Gather tree info - key-nodes & item ids, ratio, sizes"""
     import math
 
-    info = _analyze(node, 0)
+    info: dict = defaultdict(int)
+    info["depth"] = _analyze(node, info, {})
     if info["depth"]:
         pfx_nodes = info["prefix_nodes"]
         geo_cont = info["georecord_containers"]
@@ -112,50 +184,171 @@ def analyze(node: dict, sizes=False):
             info["size_itemkeys"] = utils.total_size(list(_collect(node, exact=False)))
             # ! same as above, without tree traversal, but with magic constant
             info["size_itemkeys2"] = utils.sizeof_fmt(10 * (info["itemkeys_items"]))
+            if info["subtree_containers"]:
+                info["size_subtree"] = utils.total_size(list(_subtrees(node)))
 
     return dict(info)
 
 
-def lookup(root: dict, query: str, exact: bool = False) -> List[Set[int]]:
+def minimize(root: dict) -> None:
+    """Merge equivalent nodes, which have same ids and transitions to equivalent nodes,
+    turning suffix trie into DAWG (minimal acyclic automaton). Nodes are shared afterwards,
+    so trie can't be changed anymore
+    """
+    registry: Dict[tuple, dict] = {}
+
+    def canonical(node: dict) -> dict:
+        children = sorted(node.keys() - KEYS)
+        for key in children:
+            node[key] = canonical(node[key])
+        # precomputed subtree ids are defined by these, no need to compare them
+        signature = (
+            tuple(node.get(ITEMSKEY, ())),
+            tuple(node.get(SUFFIXKEY, ())),
+            tuple((key, id(node[key])) for key in children),
+        )
+        return registry.setdefault(signature, node)
+
+    canonical(root)
+
+
+def walk(node: dict, word: str) -> Optional[dict]:
+    """Move down from node, following word, return None on dead-end"""
+    for c in word:
+        node = node.get(c)  # type: ignore
+        if not node:
+            return None
+    return node
+
+
+def lookup(root: dict, query: str, exact: bool = False) -> List[postings.Postings]:
     """Move down from specified root node, following query, and collect items ids for each word"""
     if not query:
-        return set()
-
-    word_ids: List[Set[int]] = []  # ids of items that correspond to query
-    for word in preprocess_words(query):
-        node = root
-        for c in word:
-            node: Optional[dict] = node.get(c)  # type: ignore
-            if not node:
-                # dead-end for this word
-                word_ids.append(set())
-                break
-        else:
-            word_ids.append(collect(node, exact))
+        return []
+
+    start = metrics.clock()
+    words = preprocess_words(query)
+    metrics.observe("preprocess_words", start)
+
+    word_ids: List[postings.Postings] = []  # ids of items that correspond to query
+    for word in words:
+        start = metrics.clock()
+        node = walk(root, word)
+        metrics.observe("trie_descent", start)
+        # dead-end for this word
+        start = metrics.clock()
+        word_ids.append(postings.EMPTY if node is None else collect(node, exact))
+        metrics.observe("collect", start)
 
     return word_ids
 
 
 class Trie:
-    def __init__(self):
-        self.root = utils.rec_dd()
+    def __init__(self, precompute_depth: int = 0):
+        self.root: dict = {}
         self._alphabet = set()
         self._indexed_items = 0
-
-        # methods
+        # nodes up to this depth keep sorted ids of their whole subtree
+        self.precompute_depth = precompute_depth
+        self.minimized = False
+        # nodes and postings, which can be changed in place, by id. None if none are shared
+        self._owned: Optional[Dict[int, Any]] = None
+        self._bind()
+
+    def _bind(self):
+        """Bind module functions to the root node"""
         self.collect = partial(collect, self.root)
         self.lookup = partial(lookup, self.root)
         self.show = partial(_show, self.root)
 
+    def dump(self) -> tuple:
+        """Return trie state, built from plain containers only"""
+        return self.root, self._alphabet, self._indexed_items, self.precompute_depth, self.minimized
+
+    @classmethod
+    def restore(cls, state: tuple) -> "Trie":
+        """Create trie from previously dumped state"""
+        obj = cls.__new__(cls)
+        obj.root, obj._alphabet, obj._indexed_items, obj.precompute_depth, obj.minimized = state
+        obj._owned = None
+        obj._bind()
+        return obj
+
+    def fork(self) -> "Trie":
+        """Return new trie for adding items, sharing all nodes with this one.
+        Nodes and postings on paths of added words are copied on first write, in both tries,
+        so readers of this trie don't see changes"""
+        if self.minimized:
+            raise TypeError("Minimized trie (DAWG) is read-only")
+        root = dict(self.root)
+        state = root, set(self._alphabet), self._indexed_items, self.precompute_depth, False
+        obj = self.restore(state)
+        obj._owned = {id(root): root}
+        self._owned = {}  # everything is shared now
+        return obj
+
+    def _writable(self, node: dict, key: str, new) -> Any:
+        """Return child node or postings of node by key, created with `new` if missing,
+        or copied if it's shared with other trie"""
+        value = node.get(key)
+        owned = self._owned
+        if value is None:
+            value = node[key] = new()
+        elif owned is None or id(value) in owned:
+            return value
+        else:
+            value = node[key] = copy(value)
+        if owned is not None:
+            owned[id(value)] = value
+        return value
+
+    def walk(self, word: str, node: Optional[dict] = None) -> Optional[dict]:
+        """Return node of word, moving down from node (root by default), or None"""
+        return walk(self.root if node is None else node, word)
+
+    def node_ids(self, node: dict, exact: bool = False) -> postings.Postings:
+        """Collect items ids of node, returned by `walk`"""
+        return collect(node, exact)
+
+    def children(self, node: dict) -> Iterator[Tuple[str, dict]]:
+        """Iterate over characters and child nodes of node"""
+        return ((c, node[c]) for c in node.keys() - KEYS)
+
+    def _check_private(self) -> None:
+        if self._owned is not None:
+            raise TypeError("Trie shares nodes with forked trie, it can't be changed in place")
+
+    def minimize(self) -> None:
+        """Compress trie into read-only DAWG, see `minimize`"""
+        self._check_private()
+        minimize(self.root)
+        self.minimized = True
+
+    def precompute(self, depth: int) -> None:
+        """Store sorted ids of the whole subtree in nodes up to depth (0 to disable),
+        so lookup of short prefix doesn't walk the subtree. Kept up to date on add.
+        """
+        self._check_private()
+        _precompute(self.root, depth)
+        self.precompute_depth = depth
+
     @property
     def alphabet(self):
         return f'`{"".join(sorted(self._alphabet))}`'
 
+    @property
+    def indexed(self):
+        return self._indexed_items
+
     @property
     def info(self):
         info = analyze(self.root, sizes=True)
         info["alphabet"] = self.alphabet
-        info["indexed"] = self._indexed_items
+        info["indexed"] = self.indexed
+        info["minimized"] = self.minimized
+        if self.precompute_depth:
+            info["precompute_depth"] = self.precompute_depth
+            info.update(_precompute_timing(self.root))
         return info
 
     def _add_word(self, id_: int, word: str, key: str) -> None:
@@ -163,34 +356,82 @@ class Trie:
         Append id_ to `items` list in the final node.
         Word may be splitted into subwords, which are added separately
         """
-        node = self.root
-        for c in word:
+        node, owned = self.root, self._owned
+        for depth, c in enumerate(word, 1):
             self._alphabet.add(c)
-            node = node[c]
+            child = node.get(c)
+            if child is None or (owned is not None and id(child) not in owned):
+                child = self._writable(node, c, dict)
+            node = child
+
+            if depth <= self.precompute_depth:
+                postings.insert(self._writable(node, SUBTREEKEY, new_postings), id_)
+                if key == ITEMSKEY:
+                    postings.insert(self._writable(node, SUBTREE_ITEMSKEY, new_postings), id_)
+                elif SUBTREE_ITEMSKEY not in node:
+                    node[SUBTREE_ITEMSKEY] = new_postings()
         # we can't have two different words with same tree-path
-        # but they can have multiple ids, so let's keep them in a list
-        items = node.setdefault(key, list())
-        if id_ not in items:
-            items.append(id_)
+        # but they can have multiple ids, so let's keep them in postings
+        postings.insert(self._writable(node, key, new_postings), id_)
 
-    def add(self, record: geo.GeoRecord) -> geo.GeoRecord:
+    def add(self, record: geo.GeoRecord, words: Optional[List[str]] = None) -> geo.GeoRecord:
         """Add geo names to trie in multiple languages
-        Add whole word, and all its suffixes
+        Add whole word, and all its suffixes. Words can be already normalized with `item_words`
         """
-        # ! TODO: chain
-        # Name objects for different languages
-        for lang_name in record.item:
-            # Name is iterable namedtuple: name, old_name
-            for name in lang_name:
-                # split into words
-                for word in preprocess_words(name):
-                    # retrieve suffixes
-                    for i, suffix in enumerate(suffixes(word)):
-                        key = SUFFIXKEY if i else ITEMSKEY
-                        self._add_word(record.id, suffix, key)
+        if self.minimized:
+            raise TypeError("Minimized trie (DAWG) is read-only")
+
+        for word in item_words(record.item) if words is None else words:
+            # retrieve suffixes
+            for i, suffix in enumerate(suffixes(word)):
+                key = SUFFIXKEY if i else ITEMSKEY
+                self._add_word(record.id, suffix, key)
 
         self._indexed_items += 1
         return record
 
+    def _remove_word(self, id_: int, word: str, key: str) -> None:
+        """Remove id_ from final node of word and from precomputed subtrees on its path.
+        Nodes left without items and children are removed, up to the first non-empty one"""
+        path = []  # parent node and character of each node on the path
+        node, owned = self.root, self._owned
+        for depth, c in enumerate(word, 1):
+            child = node.get(c)
+            if child is None:
+                return  # word wasn't added
+            if owned is not None and id(child) not in owned:
+                child = self._writable(node, c, dict)
+            path.append((node, c))
+            node = child
+
+            if depth <= self.precompute_depth:
+                for subtree_key in SUBTREE_KEYS:
+                    if postings.contains(node.get(subtree_key, postings.EMPTY), id_):
+                        postings.remove(self._writable(node, subtree_key, new_postings), id_)
+
+        if postings.contains(node.get(key, postings.EMPTY), id_):
+            items = self._writable(node, key, new_postings)
+            postings.remove(items, id_)
+            if not items:
+                del node[key]
+
+        for parent, c in reversed(path):
+            if parent[c].keys() - SUBTREE_KEYS:
+                break
+            del parent[c]
+
+    def remove(self, record: geo.GeoRecord, words: Optional[List[str]] = None) -> None:
+        """Remove record from nodes of its words and all their suffixes, pruning empty branches.
+        Words should be the same as added ones, by default they're taken from record names"""
+        if self.minimized:
+            raise TypeError("Minimized trie (DAWG) is read-only")
+
+        for word in set(item_words(record.item) if words is None else words):
+            for i, suffix in enumerate(suffixes(word)):
+                key = SUFFIXKEY if i else ITEMSKEY
+                self._remove_word(record.id, suffix, key)
+
+        self._indexed_items -= 1
+
 
 __all__ = ["Trie"]
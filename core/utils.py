@@ -3,16 +3,13 @@ import sys
 from itertools import chain
 from collections import deque, defaultdict
 
+from . import metrics
 
-def empty_profile(f):
-    return f
-
-
-# catch nameerror when mprof is not used
+# memory profiler decorator when run by mprof, otherwise calls are timed in metrics
 try:
     profile = profile  # type: ignore
 except NameError:
-    profile = empty_profile
+    profile = metrics.timed()
 
 
 _HANDLERS = {
@@ -58,9 +55,22 @@ def total_size(obj):
     return sizeof_fmt(sizeof(obj))
 
 
+def memory_usage(pid="self"):
+    """Returns (rss, pss, uss) of process in bytes: resident, proportional (shared pages are
+    divided between processes) and unique memory. Linux only"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if rest.strip().endswith("kB"):
+                values[key] = int(rest.split()[0]) * 1024
+    uss = values["Private_Clean"] + values["Private_Dirty"]
+    return values["Rss"], values["Pss"], uss
+
+
 def rec_dd():
     """Recursive defaultdict"""
     return defaultdict(rec_dd)
 
 
-__all__ = ["total_size", "sizeof_fmt"]
+__all__ = ["total_size", "sizeof_fmt", "memory_usage"]
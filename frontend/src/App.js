@@ -34,10 +34,11 @@ class App extends Component {
     if (name.length > 1) {
       try {
         const {
-          data: { results: locations, query: responseQuery }
+          data: { results: locations, query: responseQuery, cursor }
         } = await axios.get(api.location(), {
-          params: { q: name }
+          params: { q: name, cursor: this.cursor || "" }
         });
+        this.cursor = cursor;
         this.setState({ locations, responseQuery });
       } catch (err) {
         console.error(err);
@@ -59,6 +60,7 @@ class App extends Component {
   }
 
   handleClear(e) {
+    this.cursor = null;
     this.setState({ query: "", locations: [] });
   }
 
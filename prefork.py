@@ -0,0 +1,101 @@
+"""
+Pre-fork server: index is built once in master process, then workers are forked from it
+
+    python prefork.py -w 4 -b 127.0.0.1:5000
+
+Workers share index pages with master copy-on-write. Garbage collector is disabled
+while index is built, and all objects are moved into permanent generation with `gc.freeze`
+before fork, so collections in workers don't write to them and dirty shared pages.
+Each worker logs its unique (USS) and proportional (PSS) memory after warmup queries,
+compare with `--no-preload`, where every worker builds its own index.
+
+Backend is imported only in `load`, as importing it builds the index.
+Backend imports core as `key.core`, so the repository should be checked out as `key`
+directory, its parent is added to python path here.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+basedir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, basedir)  # backend
+sys.path.insert(0, os.path.dirname(basedir))  # key.core
+from key.core import utils  # noqa: E402
+
+WARMUP = ("к", "київ", "шевч", "вул", "1")
+
+log = logging.getLogger("gunicorn.error")
+
+
+def log_memory(name, pid="self"):
+    rss, pss, uss = utils.memory_usage(pid)
+    sizes = (utils.sizeof_fmt(size) for size in (rss, pss, uss))
+    log.info("%s memory: rss %s, pss %s, uss %s", name, *sizes)
+
+
+def pre_fork(server, worker):
+    gc.freeze()  # also objects created by master since the last fork
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def post_worker_init(worker):
+    from backend.search_engine import search_engine
+
+    for query in WARMUP:
+        search_engine.results(query)
+    log_memory(f"worker {worker.pid}")
+
+
+class PreforkApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        for hook in (pre_fork, post_fork, post_worker_init):
+            self.cfg.set(hook.__name__, hook)
+
+    def load(self):
+        if not self.cfg.preload_app:
+            from backend import application
+
+            return application
+
+        # no collections while index is built, to not leave freed holes in shared pages
+        gc.disable()
+        from backend import application
+        from backend.search_engine import search_engine
+
+        search_engine.engine.prepare()
+        gc.freeze()
+        log_memory("master")
+        return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-b", "--bind", default="127.0.0.1:5000", help="address to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of workers")
+    parser.add_argument("--threads", type=int, default=1, help="number of threads per worker")
+    parser.add_argument(
+        "--no-preload",
+        dest="preload_app",
+        action="store_false",
+        help="build index in every worker instead, to compare memory",
+    )
+    args = parser.parse_args()
+    PreforkApplication(vars(args)).run()
+
+
+if __name__ == "__main__":
+    main()